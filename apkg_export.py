@@ -0,0 +1,191 @@
+"""Incremental, sharded .apkg export with stable model/deck IDs and note GUIDs"""
+
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+import genanki
+
+MANIFEST_VERSION = 1
+
+
+def stable_id(name):
+    """Deterministic model/deck ID in the range genanki examples use (2^30 .. 2^31)"""
+    digest = int.from_bytes(hashlib.sha1(name.encode("utf-8")).digest()[:4], "big")
+    return (1 << 30) + digest % (1 << 30)
+
+
+def note_hash(note):
+    return hashlib.sha1("\x1f".join(note.fields + sorted(note.tags)).encode("utf-8")).hexdigest()
+
+
+def model_hash(model):
+    """Changes whenever the note type's fields, templates or styling change"""
+    payload = json.dumps(
+        [
+            model.name,
+            [field["name"] for field in model.fields],  # genanki adds keys to these while writing
+            [[template["name"], template["qfmt"], template["afmt"]] for template in model.templates],
+            model.css,
+        ]
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def manifest_path_for(output):
+    return os.path.splitext(output)[0] + ".manifest.json"
+
+
+def load_manifest(path):
+    """{"model_hash": ..., "notes": {guid: hash}} of the last build, or an empty one"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"version": MANIFEST_VERSION, "model_hash": None, "notes": {}}
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{path} has manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}")
+    return manifest
+
+
+def save_manifest(path, manifest):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=0)
+    os.replace(tmp, path)  # a crash mid-write keeps the previous manifest
+
+
+class StreamingPackageWriter:
+    """Write an .apkg note by note, without holding the notes in a genanki.Deck
+
+    `deck` must already have its model(s) added (deck.add_model); it is written
+    without notes to set up the collection, then every add(note) goes straight to
+    the package database.
+    """
+
+    def __init__(self, path, deck, timestamp=None, id_gen=None, commit_every=1000):
+        self.path = path
+        self.deck = deck
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.commit_every = commit_every
+        self.count = 0
+        fd, self._db_path = tempfile.mkstemp(suffix=".anki2")
+        os.close(fd)
+        self._conn = sqlite3.connect(self._db_path)
+        self._cursor = self._conn.cursor()
+        # note/card IDs; share one generator between shards so they never collide
+        self._id_gen = id_gen or itertools.count(int(self.timestamp * 1000))
+        genanki.Package(deck).write_to_db(self._cursor, self.timestamp, self._id_gen)
+
+    def add(self, note):
+        note.write_to_db(self._cursor, self.timestamp, self.deck.deck_id, self._id_gen)
+        self.count += 1
+        if self.count % self.commit_every == 0:
+            self._conn.commit()
+
+    def close(self):
+        """Finish the package file; returns the number of notes written"""
+        try:
+            self._conn.commit()
+            self._conn.close()
+            tmp = self.path + ".tmp"
+            with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as package:
+                package.write(self._db_path, "collection.anki2")
+                package.writestr("media", "{}")
+            os.replace(tmp, self.path)
+        finally:
+            os.remove(self._db_path)
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        """Drop the partial package without writing it"""
+        self._conn.close()
+        os.remove(self._db_path)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def shard_path(output, start, stop, delta=False):
+    """chinese_characters.apkg -> chinese_characters[_delta]_00001-01000.apkg"""
+    stem, ext = os.path.splitext(output)
+    return f"{stem}{'_delta' if delta else ''}_{start:05d}-{stop:05d}{ext}"
+
+
+def export_notes(notes, deck, output, delta=False, shard_size=None, manifest_path=None):
+    """Stream (rank, note) pairs, in rank order, into one or more .apkg files
+
+    With delta=True only notes whose GUID is new or whose content hash differs
+    from the previous manifest are written (everything, if the note type changed).
+    With shard_size, ranks 1..N, N+1..2N, ... go to separate packages. The
+    manifest is updated after all packages are written. Returns the written paths.
+    """
+    manifest_path = manifest_path or manifest_path_for(output)
+    previous = load_manifest(manifest_path)
+    current_model_hash = model_hash(next(iter(deck.models.values())))
+    if delta and previous["model_hash"] != current_model_hash:
+        if previous["notes"]:
+            print("Note type changed since the last build, exporting every note")
+        delta = False
+    old_hashes = previous["notes"]
+    new_hashes = {}
+
+    timestamp = time.time()
+    id_gen = itertools.count(int(timestamp * 1000))
+    written = []
+    writer = None
+    writer_range = None
+    unchanged = 0
+    try:
+        for rank, note in notes:
+            digest = note_hash(note)
+            new_hashes[note.guid] = digest
+            if delta and old_hashes.get(note.guid) == digest:
+                unchanged += 1
+                continue
+            if shard_size:
+                start = (rank - 1) // shard_size * shard_size + 1
+                wanted = (start, start + shard_size - 1)
+            else:
+                wanted = None
+            if writer is None or wanted != writer_range:
+                if writer is not None:
+                    writer.close()
+                    print(f"Wrote {writer.count} notes to {writer.path}")
+                if wanted is None:
+                    path = os.path.splitext(output)[0] + "_delta.apkg" if delta else output
+                else:
+                    path = shard_path(output, *wanted, delta=delta)
+                writer = StreamingPackageWriter(path, deck, timestamp, id_gen)
+                writer_range = wanted
+                written.append(path)
+            writer.add(note)
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        raise
+    if writer is not None:
+        writer.close()
+        print(f"Wrote {writer.count} notes to {writer.path}")
+
+    if delta:
+        removed = len(old_hashes.keys() - new_hashes.keys())
+        print(f"Delta: {len(new_hashes) - unchanged} new or changed notes, {unchanged} unchanged")
+        if removed:
+            print(f"{removed} notes from the last build are gone (delete them in Anki if needed)")
+    save_manifest(
+        manifest_path,
+        {"version": MANIFEST_VERSION, "model_hash": current_model_hash, "notes": new_hashes},
+    )
+    return written
@@ -0,0 +1,94 @@
+"""Benchmark and check cloze_text against enrich_spanish_conjugation.process_string.
+
+    python benchmarks/bench_cloze_text.py                         # synthetic 100k-card corpus
+    python benchmarks/bench_cloze_text.py --corpus cards.txt      # one card text per line
+    python benchmarks/bench_cloze_text.py --collection ~/Anki2/Zen/collection.anki2 --deck "Spanish::Conjugation"
+
+Reports cards/sec for process_string, cloze_text.normalize (uncached) and
+normalize_batch (cached, as a deck run uses it). Then it checks equivalence:
+compat mode must match process_string on every card. Cards where the default
+mode differs are counted, and a few are printed side by side (dropped hints,
+decoded entities, words split at line breaks).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+import cloze_text  # noqa: E402
+from enrich_spanish_conjugation import process_string  # noqa: E402
+
+
+def collection_texts(path, deck, field=1):
+    """Field `field` of every note in `deck`, read straight from the collection"""
+    from anki.collection import Collection
+
+    col = Collection(path)
+    try:
+        texts = []
+        for note_id in col.find_notes(f'"deck:{deck}"'):
+            fields = col.get_note(note_id).fields
+            if field < len(fields):
+                texts.append(fields[field])
+        return texts
+    finally:
+        col.close()
+
+
+def timed(label, fn, texts):
+    start = time.perf_counter()
+    fn(texts)
+    seconds = time.perf_counter() - start
+    print(f"{label:<34} {seconds:8.3f}s {len(texts) / seconds:>12.0f} cards/s")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=100_000, help="synthetic corpus size")
+    parser.add_argument("--corpus", help="file with one card text per line (\\n inside a card written as \\\\n)")
+    parser.add_argument("--collection", help="read the card texts from this Anki collection")
+    parser.add_argument("--deck", default="Spanish::Conjugation")
+    parser.add_argument("--examples", type=int, default=5, help="differing cards to print")
+    args = parser.parse_args()
+
+    if args.collection:
+        texts = collection_texts(args.collection, args.deck)
+    elif args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            texts = [line.rstrip("\n").replace("\\n", "\n") for line in f]
+    else:
+        from bench_stages import spanish_rows
+
+        texts = [row[1] for row in spanish_rows(args.cards)]
+    print(f"{len(texts)} cards, {len(set(texts))} distinct")
+
+    base = timed("process_string", lambda ts: [process_string(t) for t in ts], texts)
+    raw = timed("normalize (uncached)", lambda ts: [cloze_text.normalize.__wrapped__(t) for t in ts], texts)
+    cloze_text.normalize.cache_clear()
+    batch = timed("normalize_batch", cloze_text.normalize_batch, texts)
+    print(f"speedup: {base / raw:.1f}x uncached, {base / batch:.1f}x batch")
+
+    old = [process_string(t) for t in texts]
+    compat = cloze_text.normalize_batch(texts, compat=True)
+    new = cloze_text.normalize_batch(texts)
+    mismatches = [t for t, a, b in zip(texts, old, compat) if a != b]
+    print(f"compat mode: {len(texts) - len(mismatches)}/{len(texts)} identical to process_string")
+    for text in mismatches[:args.examples]:
+        print(f"  MISMATCH {text!r}\n    process_string: {process_string(text)!r}\n    compat:         {cloze_text.normalize(text, True)!r}")
+
+    differing = [(t, a, b) for t, a, b in zip(texts, old, new) if a != b]
+    print(f"default mode: {len(differing)}/{len(texts)} cards differ from process_string")
+    for text, a, b in differing[:args.examples]:
+        print(f"  {text!r}\n    process_string: {a!r}\n    normalize:      {b!r}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Benchmark every stage on synthetic collections with a deterministic stub LLM.
+
+    python benchmarks/bench_stages.py                                   # 1k/10k/100k notes, all stages
+    python benchmarks/bench_stages.py --sizes 1000 --stages update_pinyin update_english
+    python benchmarks/bench_stages.py --latency 0.2 --token-latency 0.02 --pack-size 8 --json run.json
+
+Synthetic collections use the subs2srs field layout from the README (fields 0-14)
+and the Spanish conjugation layout (cloze sentence in field 1, definition in
+field 2). They are generated once per size under --data and copied before each
+stage, since stages write to them. Every stage runs in its own process, so the
+reported peak RSS belongs to that stage alone. The LLM is benchmarks/stub_llm.py's
+StubModel, whose fixed latency stands in for prefill/decode time.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+SUBS2SRS_DECK = "All::Mandarin::sentences"
+SPANISH_DECK = "Spanish::Conjugation"
+SUBS2SRS_FIELDS = [
+    "Sequence Marker",
+    "Target",
+    "Simplified",
+    "Traditional",
+    "Pinyin",
+    "English",
+    "Snapshot",
+    "Audio",
+    "Notes",
+    "Proper_nounts",
+    "English_Definition",
+    "am-unknowns",
+    "am-unknowns-count",
+    "am-highlighted",
+    "am-difficulty",
+]
+SPANISH_FIELDS = ["Verb", "Text", "English_Definition"]
+
+SUBS2SRS_STAGES = ["trad_to_simp", "update_pinyin", "update_english", "update_target_english_definition"]
+# cloze_normalize is what the Spanish deck runs; process_string is the legacy cleaner
+SPANISH_STAGES = ["cloze_normalize", "process_string"]
+STAGES = SUBS2SRS_STAGES + SPANISH_STAGES + ["create_char_deck"]
+
+SPANISH_VERBS = [
+    ("hablar", ["hablo", "hablas", "habló", "hablaba", "hablaré", "hablaría"]),
+    ("comer", ["como", "comes", "comió", "comía", "comeré", "comería"]),
+    ("vivir", ["vivo", "vives", "vivió", "vivía", "viviré", "viviría"]),
+    ("ser", ["soy", "eres", "fue", "era", "seré", "sería"]),
+    ("tener", ["tengo", "tienes", "tuvo", "tenía", "tendré", "tendría"]),
+    ("ir", ["voy", "vas", "fue", "iba", "iré", "iría"]),
+]
+SPANISH_TENSES = ["presente", "presente", "pretérito", "imperfecto", "futuro", "condicional"]
+SPANISH_WORDS = "yo tú ella nosotros mañana ayer siempre con mi madre en casa el libro la playa muy bien".split()
+
+
+def subs2srs_rows(count, seed=0):
+    """Field lists in the subs2srs layout; pinyin and english start empty"""
+    from bench_text_norm import synthetic_corpus
+
+    rng = random.Random(seed)
+    rows = []
+    for n, sentence in enumerate(synthetic_corpus(count, seed=seed)):
+        unknowns = rng.choice([0, 1, 1, 2])
+        word = sentence[:rng.randint(1, 2)] if unknowns else ""
+        rows.append([
+            f"{n // 500 + 1:03d}_{n % 500:04d}",  # sequence marker
+            sentence,  # target
+            sentence,  # simplified (a share is still traditional)
+            "",
+            "",  # pinyin
+            "",  # english
+            f'<img src="snapshot_{n}.jpg">',
+            f"[sound:audio_{n}.mp3]",
+            "",
+            "",
+            "",  # english definition
+            word,
+            str(unknowns),
+            "",
+            str(rng.randint(1, 100)),
+        ])
+    return rows
+
+
+def spanish_rows(count, seed=0):
+    """Cloze sentences with hints, HTML and the deck's glyphs; definitions start empty"""
+    rng = random.Random(seed)
+    rows = []
+    for n in range(count):
+        infinitive, forms = rng.choice(SPANISH_VERBS)
+        person = rng.randrange(len(forms))
+        before = " ".join(rng.choices(SPANISH_WORDS, k=rng.randint(1, 4)))
+        after = " ".join(rng.choices(SPANISH_WORDS, k=rng.randint(1, 5)))
+        glyph = rng.choice(["", "⇠ ", "→ ", "…", "⊙ "])
+        text = (
+            f"<div>{glyph}{before.capitalize()} {{{{c1::{forms[person]}::{infinitive} "
+            f"({SPANISH_TENSES[person]})}}}} {after}.</div>"
+        )
+        if n % 7 == 0:
+            text += "<br>\n<i>(nota)</i>"
+        rows.append([infinitive, text, ""])
+    return rows
+
+
+def create_collection(path, deck_name, note_type, field_names, rows):
+    from anki.collection import Collection
+
+    col = Collection(path)
+    models = col.models
+    model = models.new(note_type)
+    for name in field_names:
+        models.add_field(model, models.new_field(name))
+    template = models.new_template("Card 1")
+    template["qfmt"] = "{{%s}}" % field_names[1]
+    template["afmt"] = "{{FrontSide}}<hr id=answer>{{%s}}" % field_names[2]
+    models.add_template(model, template)
+    models.add(model)
+    model = models.by_name(note_type)
+    deck_id = col.decks.id(deck_name)
+    for row in rows:
+        note = col.new_note(model)
+        for i, value in enumerate(row):
+            note.fields[i] = value
+        col.add_note(note, deck_id)
+    col.close()
+
+
+def prepare_collection(data_dir, layout, size):
+    """Create (or reuse) the pristine `layout` ("subs2srs" or "spanish") collection of `size` notes"""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"{layout}_{size}.anki2")
+    if not os.path.exists(path):
+        start = time.perf_counter()
+        tmp = os.path.join(data_dir, f"{layout}_{size}.tmp.anki2")  # Anki wants the .anki2 suffix
+        if layout == "subs2srs":
+            create_collection(tmp, SUBS2SRS_DECK, "subs2srs", SUBS2SRS_FIELDS, subs2srs_rows(size))
+        else:
+            create_collection(tmp, SPANISH_DECK, "Spanish Cloze", SPANISH_FIELDS, spanish_rows(size))
+        os.replace(tmp, path)
+        print(f"Built {os.path.basename(path)} in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def run_stage(stage, size, collection, workdir, args):
+    """Run one stage in this process; returns (notes, seconds)"""
+    from llm_cache import LLMCache
+    from stub_llm import StubModel
+
+    model = StubModel(latency=args.latency, token_latency=args.token_latency)
+    cache_path = os.path.join(workdir, "llm_cache.sqlite")
+
+    if stage in SUBS2SRS_STAGES:
+        import enrich_subs2srs
+
+        enrich_subs2srs.col_path = collection
+        enrich_subs2srs.deck_name = SUBS2SRS_DECK
+        enrich_subs2srs.use_tm = False
+        enrich_subs2srs.resources.set("model", model)  # skip loading a real model
+        enrich_subs2srs.resources.set("cache", LLMCache(cache_path))
+        enrich_subs2srs.get_collection()
+        start = time.perf_counter()
+        enrich_subs2srs.enrich([stage], incremental=False, pack_size=args.pack_size)
+        seconds = time.perf_counter() - start
+        enrich_subs2srs.close()
+        return size, seconds
+
+    if stage in SPANISH_STAGES:
+        import cloze_text
+        import enrich_spanish_conjugation
+
+        enrich_spanish_conjugation.col_path = collection
+        enrich_spanish_conjugation.deck_name = SPANISH_DECK
+        col = enrich_spanish_conjugation.get_collection()
+        texts = [col.get_note(note_id).fields[1] for note_id in enrich_spanish_conjugation.get_notes()]
+        clean = enrich_spanish_conjugation.process_string
+        if stage == "cloze_normalize":
+            cloze_text.normalize.cache_clear()  # time tokenizing, not a warm cache
+            clean = cloze_text.normalize
+        start = time.perf_counter()
+        for text in texts:
+            clean(text)
+        seconds = time.perf_counter() - start
+        enrich_spanish_conjugation.close()
+        return len(texts), seconds
+
+    if stage == "create_char_deck":
+        import char_deck_creation
+
+        os.chdir(workdir)  # the .apkg is written to the working directory
+        notes = min(size, len(char_deck_creation.load_index()))
+        start = time.perf_counter()
+        char_deck_creation.create_char_deck(
+            resume=False, cache_path=cache_path, pack_size=args.pack_size, limit=size, model=model
+        )
+        return notes, time.perf_counter() - start
+
+    raise ValueError(f"unknown stage {stage}")
+
+
+def child(args):
+    """Entry point of the per-stage process: writes its result as JSON"""
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        collection = os.path.join(workdir, "collection.anki2")
+        if args.collection:
+            shutil.copy(args.collection, collection)
+        notes, seconds = run_stage(args.child, args.size, collection, workdir, args)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {
+        "stage": args.child,
+        "size": args.size,
+        "notes": notes,
+        "seconds": seconds,
+        "notes_per_sec": notes / seconds if seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+
+
+def spawn(stage, size, collection, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_path = f.name
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child", stage,
+        "--size", str(size),
+        "--result", result_path,
+        "--latency", str(args.latency),
+        "--token-latency", str(args.token_latency),
+        "--pack-size", str(args.pack_size),
+    ]
+    if collection:
+        command += ["--collection", collection]
+    try:
+        subprocess.run(command, check=True, stdout=None if args.verbose else subprocess.DEVNULL)
+        with open(result_path) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub LLM seconds per call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="stub LLM seconds per token")
+    parser.add_argument("--pack-size", type=int, default=1, help="items per prompt")
+    parser.add_argument("--data", default=os.path.join(BENCH, "data"), help="where synthetic collections are kept")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' own output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--collection", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    results = []
+    print(f"{'notes':>8}  {'stage':<34} {'seconds':>9} {'notes/sec':>11} {'peak RSS':>10}")
+    for size in args.sizes:
+        for stage in args.stages:
+            collection = None  # create_char_deck reads CharFreq.txt instead
+            if stage in SUBS2SRS_STAGES:
+                collection = prepare_collection(args.data, "subs2srs", size)
+            elif stage in SPANISH_STAGES:
+                collection = prepare_collection(args.data, "spanish", size)
+            result = spawn(stage, size, collection, args)
+            results.append(result)
+            print(
+                f"{result['notes']:>8}  {stage:<34} {result['seconds']:>9.2f} "
+                f"{result['notes_per_sec']:>11.0f} {result['peak_rss_mb']:>8.0f}MB"
+            )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark pinyin / traditional->simplified conversion, per-sentence vs text_norm.
+
+    python benchmarks/bench_text_norm.py                      # synthetic 50k-line corpus
+    python benchmarks/bench_text_norm.py --corpus subs.txt    # one subtitle line per line
+
+The synthetic corpus is drawn from CharFreq.txt by frequency, with repeated lines
+(as in real subtitle decks) and a share of lines converted to traditional characters.
+It is only good for timing: s2t never produces phrase-level spellings such as 瞭解,
+so check "output mismatches" against a real traditional corpus (--corpus).
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import text_norm  # noqa: E402
+
+
+def synthetic_corpus(lines=50_000, repeat_share=0.3, traditional_share=0.2, seed=0):
+    """Subtitle-like lines of 2-20 characters sampled by character frequency"""
+    import opencc
+
+    rng = random.Random(seed)
+    with open(os.path.join(ROOT, "CharFreq.txt"), "rb") as f:
+        text = f.read().decode("gb18030", errors="replace")
+    chars, weights = [], []
+    for line in text.splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 3 and not line.startswith("/*") and parts[2].isdigit():
+            chars.append(parts[1])
+            weights.append(int(parts[2]))
+    to_traditional = opencc.OpenCC("s2t")
+    corpus = []
+    for _ in range(lines):
+        if corpus and rng.random() < repeat_share:
+            corpus.append(rng.choice(corpus))
+            continue
+        sentence = "".join(rng.choices(chars, weights, k=rng.randint(2, 20)))
+        if rng.random() < traditional_share:
+            sentence = to_traditional.convert(sentence)
+        corpus.append(sentence)
+    return corpus
+
+
+def baseline(corpus):
+    """What enrich_subs2srs did before: one OpenCC and one pypinyin call per sentence"""
+    import opencc
+    from pypinyin import pinyin
+
+    converter = opencc.OpenCC("t2s")
+    simplified = [converter.convert(sentence) for sentence in corpus]
+    pinyins = [
+        " ".join(item for sublist in pinyin(sentence) for item in sublist)
+        for sentence in simplified
+    ]
+    return simplified, pinyins
+
+
+def engine(corpus):
+    simplified = text_norm.to_simplified_batch(corpus)
+    pinyins = text_norm.to_pinyin_batch(simplified)
+    return simplified, pinyins
+
+
+def timed(label, func, corpus):
+    start = time.perf_counter()
+    result = func(corpus)
+    seconds = time.perf_counter() - start
+    print(f"{label:<12} {seconds:8.2f}s  {len(corpus) / seconds:10.0f} sentences/sec")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="text file with one sentence per line")
+    parser.add_argument("--lines", type=int, default=50_000, help="synthetic corpus size")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        corpus = synthetic_corpus(args.lines)
+    print(f"{len(corpus)} sentences, {len(set(corpus))} unique")
+
+    text_norm.trad_only_chars()  # one-off setup, not part of the per-sentence cost
+    before = timed("before", baseline, corpus)
+    after = timed("after", engine, corpus)
+    mismatches = sum(a != b for a, b in zip(before[0] + before[1], after[0] + after[1]))
+    print(f"output mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
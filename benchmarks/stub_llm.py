@@ -0,0 +1,169 @@
+"""Deterministic stand-ins for a real LLM.
+
+StubModel is a drop-in for GPT4All / llm_backend backends, and `serve` runs an
+OpenAI-compatible /v1/completions HTTP server around the same replies, for
+exercising OpenAIServerBackend without llama.cpp:
+
+    python benchmarks/stub_llm.py --port 8080 --latency 0.05
+    python cli.py english --model http://127.0.0.1:8080
+"""
+
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_NUMBERED = re.compile(r"^\[(\d+)\]\s*(.*)$", re.MULTILINE)
+_QUOTED = re.compile(r"'([^']+)'")
+
+
+def stub_reply(prompt):
+    """A deterministic answer in the format each script's prompt asks for"""
+    items = _NUMBERED.findall(prompt)
+    if items:  # packed prompt: answer every numbered item
+        return "\n".join(f"[{number}] stub {_digest(item)}" for number, item in items)
+    if "Generate exactly three examples" in prompt:
+        quoted = _QUOTED.findall(prompt.split("MUST contain", 1)[-1])
+        character = quoted[0] if quoted else "字"
+        return "\n".join(
+            f"{character}{suffix} (x) - stub example {n}" for n, suffix in enumerate("们人子", 1)
+        )
+    return f"stub {_digest(prompt)}"
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+
+
+class StubModel:
+    """GPT4All-compatible model with a fixed per-call latency and per-token delay"""
+
+    def __init__(self, latency=0.0, token_latency=0.0, reply=stub_reply, name="stub"):
+        self.latency = latency  # seconds per call (prefill)
+        self.token_latency = token_latency  # seconds per streamed token (decode)
+        self.reply = reply
+        self.name = name
+        self.concurrency = 1
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, max_tokens=200, temp=0.0, callback=None, **params):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        text = self.reply(prompt)
+        if callback is None:
+            time.sleep(self.token_latency * len(text.split()))
+            return text
+        out = []
+        for token in re.findall(r"\S+\s*|\s+", text):  # whitespace-delimited "tokens"
+            time.sleep(self.token_latency)
+            out.append(token)
+            if callback(0, token) is False:
+                break
+        return "".join(out)
+
+    def close(self):
+        pass
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so the client's pool is exercised
+    latency = 0.0
+    fail_every = 0  # answer every Nth request with a 503 to exercise retries
+    drop_stream_after = 0  # close streams after this many tokens, mid-response
+    requests = 0
+    connections = None  # client (host, port) pairs seen, one per TCP connection
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        handler = type(self)
+        with handler.lock:
+            handler.requests += 1
+            handler.connections.add(self.client_address)
+            count = handler.requests
+        if self.path != "/v1/completions":
+            self._send(404, b'{"error": "not found"}')
+            return
+        if self.fail_every and count % self.fail_every == 0:
+            self._send(503, b'{"error": "busy"}')
+            return
+        time.sleep(self.latency)
+        text = stub_reply(body["prompt"])
+        if not body.get("stream"):
+            self._send(200, json.dumps({"choices": [{"text": text}]}).encode("utf-8"))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for n, token in enumerate(re.findall(r"\S+\s*|\s+", text)):
+                if self.drop_stream_after and n == self.drop_stream_after:
+                    self.close_connection = True
+                    return
+                self._chunk(b"data: " + json.dumps({"choices": [{"text": token}]}).encode("utf-8") + b"\n\n")
+            self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):  # client stopped early
+            self.close_connection = True
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send(self, status, data):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host="127.0.0.1", port=0, latency=0.0, fail_every=0, drop_stream_after=0):
+    """Start the stub server in a background thread; returns (server, base_url)
+
+    Request and connection counts are on `server.RequestHandlerClass`.
+    """
+    handler = type(
+        "Handler",
+        (_Handler,),
+        {
+            "latency": latency,
+            "fail_every": fail_every,
+            "drop_stream_after": drop_stream_after,
+            "requests": 0,
+            "connections": set(),
+            "lock": threading.Lock(),
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--fail-every", type=int, default=0, help="503 every Nth request")
+    args = parser.parse_args()
+    server, url = serve(args.host, args.port, args.latency, args.fail_every)
+    print(f"Stub LLM server on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,38 @@
 import genanki
-import random
-from gpt4all import GPT4All
-from pypinyin import pinyin, Style
+import multiprocessing
+import os
+import time
+from pypinyin import Style
+from llm_backend import is_server, make_backend
+from llm_cache import LLMCache, cached_generate, DEFAULT_CACHE_PATH
+from prompt_packing import generate_packed
+from run_metrics import RunMetrics
+from text_norm import to_pinyin
+from char_freq_index import load_index
+from apkg_export import export_notes, stable_id
 # from anthropic import Anthropic
 
-def parse_char_freq():
-    """Parse CharFreq.txt and extract character, pinyin, and English definition"""
-    char_data = []
-    
-    # Try different encodings commonly used for Chinese text
-    encodings = ['gb18030', 'gbk', 'gb2312', 'utf-8']
-    
-    for encoding in encodings:
-        try:
-            with open('CharFreq.txt', 'r', encoding=encoding) as f:
-                for line in f:
-                    # Skip empty lines or header lines
-                    if not line.strip() or line.startswith('/*'):
-                        continue
-                        
-                    # Split the line by tabs
-                    parts = line.strip().split('\t')
-                    
-                    # Check if we have the minimum required parts (rank, character, frequency, cumulative_freq)
-                    if len(parts) >= 4:
-                        rank = parts[0]
-                        character = parts[1]
-                        frequency = parts[2]
-                        cumulative_freq = parts[3]
-                        
-                        # Handle optional fields with default values
-                        pinyin = parts[4] if len(parts) > 4 and parts[4].strip() else ""
-                        english = parts[5] if len(parts) > 5 and parts[5].strip() else ""
-                        
-                        # Skip entries with invalid characters
-                        if character.strip() and not character.startswith('�'):
-                            char_data.append({
-                                'rank': int(rank),
-                                'character': character,
-                                'frequency': int(frequency),
-                                'cumulative_freq': float(cumulative_freq),
-                                'pinyin': pinyin,
-                                'english': english
-                            })
-            # If we successfully read the file, break the loop
-            break
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            print(f"Error with encoding {encoding}: {str(e)}")
-            continue
-    
+model_name = "Meta-Llama-3-8B-Instruct.Q4_0.gguf"
+# model_name = "Llama-3.2-1B-Instruct-Q4_0.gguf"
+# model_name = "http://127.0.0.1:8080"  # OpenAI-compatible server (llama.cpp server etc.)
+concurrency = 8  # in-flight requests when model_name is a server URL
+meter = RunMetrics("char_deck")  # phase timings, counters and progress of the run
+model_ram_gb = 5.0  # approximate resident size of one loaded copy of the model
+
+def parse_char_freq(limit=None):
+    """Extract character, pinyin, and English definition from the compiled CharFreq index
+
+    The index is (re)built from CharFreq.txt when missing or stale; `limit` keeps
+    only the `limit` most frequent characters.
+    """
+    index = load_index()
+    entries = index.top(limit) if limit is not None else list(index)
+    index.close()
+    char_data = [entry._asdict() for entry in entries]
+
     if not char_data:
-        raise Exception("Could not read file with any of the attempted encodings")
-    
+        raise Exception("No characters found in CharFreq.txt")
+
     print(f"Successfully parsed {len(char_data)} characters")
     
     # Print some statistics about missing fields
@@ -65,11 +44,340 @@ def parse_char_freq():
     return char_data
 
 
-def create_char_deck():
+def build_prompt(character):
+    """Prompt asking the model for three example words containing `character`"""
+    return f"""
+    Generate exactly three examples following this EXACT format:
+    'Chinese word in simplified chinese characters' (pinyin) - English definition
+
+    Rules:
+    - Each example MUST be 2-4 characters long in simplified Chinese
+    - Each example MUST contain '{character}'
+    - Each example MUST include pinyin in parentheses
+    - Each example MUST include English definition after a hyphen
+    - Put each example on a new line
+    - NO additional text or explanations
+
+    Example format:
+    example (pinyin) - english definition"""
+
+
+# Shared rules for packed prompts: stated once, followed by K numbered characters
+packed_instructions = """
+    For EACH numbered Chinese character below, generate exactly three examples following this EXACT format:
+    'Chinese word in simplified chinese characters' (pinyin) - English definition
+
+    Rules:
+    - Each example MUST be 2-4 characters long in simplified Chinese
+    - Each example MUST contain the character it is listed for
+    - Each example MUST include pinyin in parentheses
+    - Each example MUST include English definition after a hyphen
+    - Start each character's answer with its number in square brackets, e.g. [1]
+    - Put each example on a new line
+    - NO additional text or explanations
+
+    Example format:
+    [1]
+    example (pinyin) - english definition
+
+    Characters:"""
+
+
+def parse_example_line(line, character):
+    """Validate one output line and return it with re-derived pinyin, or None"""
+    line = line.strip()
+    if not line or len(line) < 4:
+        return None
+
+    try:
+        # Split into Chinese and English parts
+        chinese_part = line.split('(')[0].strip().strip("'").strip().strip('"').strip()  # Remove quotes
+        english_part = line.split('-')[1].strip()
+        # Generate correct pinyin using pypinyin (memoized per word)
+        pinyin_part = to_pinyin(chinese_part, style=Style.TONE)
+
+        if (character in chinese_part and
+            1 < len(chinese_part) <= 8 and
+            pinyin_part):
+            # Reconstruct the line with correct pinyin
+            return f"{chinese_part} ({pinyin_part}) - {english_part}"
+    except (IndexError, Exception):
+        pass
+    return None
+
+
+def parse_examples(text, character):
+    """Validate raw model output line by line and return up to 3 unique examples"""
+    valid_examples = []
+    for line in text.split('\n'):
+        valid_line = parse_example_line(line, character)
+        if valid_line is not None and valid_line not in valid_examples:
+            valid_examples.append(valid_line)
+
+    # Take up to 3 valid examples
+    return valid_examples[:3]
+
+
+class ExampleStream:
+    """GPT4All token callback that validates lines as they stream in and stops early
+
+    Generation stops once `wanted` distinct valid examples are collected, or as soon
+    as the output clearly cannot match the format: after the first "word (pinyin) -
+    definition" shaped line, `max_bad_lines` lines in a row without that shape, or a
+    line running past `max_line_chars` without a newline. A preamble before the list
+    and well-formed lines for the wrong character don't count toward the stop.
+    """
+
+    def __init__(self, character, wanted=3, max_bad_lines=3, max_line_chars=120, meter=None):
+        self.character = character
+        self.wanted = wanted
+        self.max_bad_lines = max_bad_lines
+        self.max_line_chars = max_line_chars
+        self.meter = meter
+        self.buffer = ""
+        self.examples = []
+        self.bad_lines = 0
+        self.started = False  # seen an example-shaped line yet
+        self.stop_reason = None
+
+    def __call__(self, token_id, response):
+        if self.meter is not None:
+            self.meter.callback(token_id, response)
+        self.buffer += response
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            if not self._check_line(line):
+                return False
+        if len(self.buffer) > self.max_line_chars:
+            self.stop_reason = "runaway line"
+            return False
+        return True
+
+    def _check_line(self, line):
+        if len(line.strip()) < 4:  # blank lines and numbering are neutral
+            return True
+        if '(' not in line or '-' not in line:  # not an example line at all
+            if self.started:
+                self.bad_lines += 1
+                if self.bad_lines >= self.max_bad_lines:
+                    self.stop_reason = "unparseable output"
+                    return False
+            return True
+        self.started = True
+        self.bad_lines = 0
+        valid_line = parse_example_line(line, self.character)
+        if valid_line is None:
+            return True
+        if valid_line not in self.examples:
+            self.examples.append(valid_line)
+        if len(self.examples) >= self.wanted:
+            self.stop_reason = "complete"
+            return False
+        return True
+
+
+def generate_examples(model, entry, cache=None, meter=None, retries=2):
+    """Prompt the model for one character and return its example field ("" if none are valid)
+
+    Tokens stream through ExampleStream, which stops generation as soon as three
+    valid examples are in. A character with no valid example is retried up to
+    `retries` times at increasing temperature.
+    """
+    log = meter.log if meter is not None else print
+    for attempt in range(retries + 1):
+        temp = min(1.0, 0.3 * attempt)  # greedy first, then sample
+        stream = ExampleStream(entry['character'], meter=meter)
+        example_field = cached_generate(
+            model,
+            build_prompt(entry['character']),
+            cache=cache,
+            model_name=model_name,
+            callback=stream,
+            metrics=meter,
+            cache_if=lambda output: stream.stop_reason != "unparseable output",  # cut short, let a rerun retry
+            max_tokens=200,
+            temp=temp,
+        )
+        log("raw example")
+        log(example_field)
+        log("---")
+        if stream.stop_reason is not None and stream.stop_reason != "complete":
+            log(f"Stopped early: {stream.stop_reason}")
+            if meter is not None:
+                meter.count(f"stopped_{stream.stop_reason.replace(' ', '_')}")
+        start = time.perf_counter()
+        valid_examples = parse_examples(example_field, entry['character'])
+        if meter is not None:
+            meter.record("validation", time.perf_counter() - start)
+        if valid_examples:
+            break
+        if attempt < retries:
+            log(f"Retrying {entry['character']} (attempt {attempt + 2}/{retries + 1})")
+            if meter is not None:
+                meter.count("retries")
+
+    # If we have no valid examples, provide a fallback
+    if not valid_examples:
+        log(f"No valid examples found for {entry['character']}")
+        if meter is not None:
+            meter.count("no_examples")
+        example_field = ""
+    else:
+        example_field = '\n'.join(valid_examples)
+    log("valid example")
+    log(example_field)
+    return example_field
+
+
+def _packed_answer(entry, answer):
+    valid_examples = parse_examples(answer, entry['character'])
+    return '\n'.join(valid_examples) if valid_examples else None
+
+
+def generate_entries(model, entries, cache=None, pack_size=1, meter=None, retries=2):
+    """Return [(rank, example_field)], packing pack_size characters into each prompt
+
+    Characters whose packed answer is missing or has no valid example are retried
+    with the single-character prompt (and its own retry budget).
+    """
+    fields = generate_packed(
+        model,
+        entries,
+        packed_instructions,
+        lambda entry: entry['character'],
+        _packed_answer,
+        lambda entry: generate_examples(model, entry, cache, meter=meter, retries=retries),
+        pack_size=pack_size,
+        cache=cache,
+        model_name=model_name,
+        meter=meter,
+        max_tokens_per_item=100,
+        concurrency=getattr(model, "concurrency", 1),
+        temp=0.0,
+    )
+    return [(entry['rank'], field) for entry, field in zip(entries, fields)]
+
+
+# Per-process state for the worker pool (each worker holds its own model copy)
+_worker_model = None
+_worker_cache = None
+_worker_pack_size = 1
+_worker_retries = 2
+_worker_verbose = True
+
+
+def _init_worker(name, n_threads, cache_path, resume, checkpoint_every, pack_size, retries, verbose):
+    global model_name, _worker_model, _worker_cache, _worker_pack_size, _worker_retries, _worker_verbose
+    model_name = name  # spawned workers re-import this module, so take the parent's (CLI) setting
+    _worker_model = make_backend(model_name, n_threads=n_threads, verbose=False)
+    _worker_cache = LLMCache(cache_path, checkpoint_every=checkpoint_every, resume=resume)
+    _worker_pack_size = pack_size
+    _worker_retries = retries
+    _worker_verbose = verbose
+
+
+def _generate_shard(entries):
+    shard_meter = RunMetrics("char_deck shard", progress_every=0, verbose=_worker_verbose)
+    results = generate_entries(
+        _worker_model, entries, _worker_cache, _worker_pack_size, shard_meter, _worker_retries
+    )
+    _worker_cache.checkpoint()  # workers are terminated without cleanup, so flush access times per shard
+    return results, shard_meter.snapshot()
+
+
+def plan_workers(workers, threads=None, max_ram_gb=None):
+    """Cap the worker count by the RAM budget and split CPU threads between workers"""
+    if max_ram_gb is not None:
+        fit = max(1, int(max_ram_gb // model_ram_gb))
+        if fit < workers:
+            print(f"RAM cap {max_ram_gb} GB fits {fit} model copies, using {fit} workers instead of {workers}")
+            workers = fit
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    return workers, threads
+
+
+def generate_all_examples(
+    char_data,
+    workers=1,
+    threads=None,
+    max_ram_gb=None,
+    shard_size=25,
+    cache_path=DEFAULT_CACHE_PATH,
+    resume=True,
+    checkpoint_every=50,
+    pack_size=1,
+    retries=2,
+    model=None,
+):
+    """Return {rank: example_field} for every entry, sharding across a process pool if workers > 1
+
+    When model_name is a server URL the server does the batching, so a single
+    process keeps `concurrency` prompts in flight instead of starting workers.
+    A ready `model` (e.g. a benchmark stub) is used in-process instead of model_name.
+    """
+    if model is not None or is_server(model_name):
+        workers = 1
+    workers, threads = plan_workers(workers, threads, max_ram_gb)
+    examples = {}
+    meter.start(total=len(char_data))
+
+    if workers == 1:
+        owned = model is None
+        if owned:
+            model = make_backend(model_name, concurrency=concurrency, n_threads=threads, verbose=True)
+        cache = LLMCache(cache_path, checkpoint_every=checkpoint_every, resume=resume)
+        step = pack_size * model.concurrency
+        for i in range(0, len(char_data), step):
+            batch = char_data[i:i + step]
+            characters = ''.join(entry['character'] for entry in batch)
+            meter.log('-------------------')
+            meter.log(f"Processing character {characters} ({i + len(batch)}/{len(char_data)})")
+            examples.update(generate_entries(model, batch, cache, pack_size, meter, retries))
+            meter.advance(len(batch))
+        cache.close()
+        if owned:
+            model.close()
+        print(cache.stats())
+        meter.report("Example generation")
+        return examples
+
+    print(f"Sharding {len(char_data)} characters across {workers} workers ({threads} threads each)")
+    shards = [char_data[i:i + shard_size] for i in range(0, len(char_data), shard_size)]
+    ctx = multiprocessing.get_context("spawn")  # don't fork a process that may hold model state
+    with ctx.Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(model_name, threads, cache_path, resume, checkpoint_every, pack_size, retries, meter.verbose),
+    ) as pool:
+        for results, snapshot in pool.imap_unordered(_generate_shard, shards):
+            examples.update(results)
+            meter.merge(snapshot)
+            meter.advance(len(results))
+            meter.log(f"Processed {len(examples)}/{len(char_data)} characters")
+    meter.report("Example generation")
+    return examples
+
+
+def create_char_deck(
+    resume=True,  # reuse cached model outputs, so a rerun only prompts for unfinished characters
+    cache_path=DEFAULT_CACHE_PATH,
+    checkpoint_every=50,
+    workers=1,  # processes, each holding its own model copy with `threads` CPU threads
+    threads=None,
+    max_ram_gb=None,  # caps the number of model copies loaded at once
+    pack_size=1,  # characters per prompt
+    retries=2,  # extra prompts for characters left without a valid example
+    limit=None,  # only the `limit` most frequent characters
+    model=None,  # a ready model (e.g. a benchmark stub) instead of loading model_name
+    output='chinese_characters.apkg',
+    delta=False,  # only package notes new or changed since the last build's manifest
+    shard_size=None,  # split the output into rank ranges (1-1000, ...)
+):
     """Create a new Anki deck with character frequency data"""
     
     # Create the note model (template)
-    model_id = random.randrange(1 << 30, 1 << 31)  # Random ID for the model
+    model_id = stable_id('Chinese Character Model')  # Same ID every build, so Anki updates in place
     char_model = genanki.Model(
         model_id,
         'Chinese Character Model',
@@ -129,105 +437,55 @@ def create_char_deck():
         '''
     )
 
-    missing_chars = []
-
     # Create a new deck
-    deck_id = random.randrange(1 << 30, 1 << 31)  # Random ID for the deck
+    deck_id = stable_id('Chinese Characters')
     deck = genanki.Deck(deck_id, 'Chinese Characters')
+    deck.add_model(char_model)  # notes are streamed to the package, not added to the deck
 
     # Get character data
-    char_data = parse_char_freq()
+    char_data = parse_char_freq(limit)
 
-    model = GPT4All(model_name="Meta-Llama-3-8B-Instruct.Q4_0.gguf", verbose=True)
-    # model = GPT4All(model_name="Llama-3.2-1B-Instruct-Q4_0.gguf", verbose=True)
-    # Add system prompt and template
-    system_prompt = "You are a helpful Chinese language assistant. Provide clear, accurate examples of Chinese words and phrases."
-    
-    count = 0
     print("getting examples...")
-    for entry in char_data:
-        count += 1
-        print('-------------------')
-        print(f"Processing character {entry['character']} ({count}/{len(char_data)})")
-
-        # Create a more structured prompt with clear instructions
-         # Improved prompt with more explicit formatting instructions
-        prompt = f"""
-    Generate exactly three examples following this EXACT format:
-    'Chinese word in simplified chinese characters' (pinyin) - English definition
+    examples = generate_all_examples(
+        char_data,
+        workers=workers,
+        threads=threads,
+        max_ram_gb=max_ram_gb,
+        cache_path=cache_path,
+        resume=resume,
+        checkpoint_every=checkpoint_every,
+        pack_size=pack_size,
+        retries=retries,
+        model=model,
+    )
 
-    Rules:
-    - Each example MUST be 2-4 characters long in simplified Chinese
-    - Each example MUST contain '{entry['character']}'
-    - Each example MUST include pinyin in parentheses
-    - Each example MUST include English definition after a hyphen
-    - Put each example on a new line
-    - NO additional text or explanations
+    # Merge results back in rank order
+    missing_chars = []
 
-    Example format:
-    example (pinyin) - english definition"""
-    
+    def notes():
+        for entry in sorted(char_data, key=lambda e: e['rank']):
+            example_field = examples[entry['rank']]
+            if not example_field:
+                missing_chars.append(entry['character'])
+            build_start = time.perf_counter()
+            note = genanki.Note(
+                model=char_model,
+                fields=[
+                    entry['character'],
+                    entry['pinyin'],
+                    entry['english'],
+                    example_field,
+                    str(entry['rank'])  # Convert rank to string
+                ],
+                guid=genanki.guid_for(entry['character']),  # stable across builds
+            )
+            meter.record("note_build", time.perf_counter() - build_start)
+            yield entry['rank'], note
 
-         # Generate examples using model
-        example_field = model.generate(prompt, max_tokens=200, temp=0.0)
-        print("raw example")
-        print(example_field)
-        print("---")
-        valid_examples = []
-        for line in example_field.split('\n'):
-            line = line.strip()
-            if not line or len(line) < 4:
-                continue
-                
-            try:
-                # Split into Chinese and English parts
-                chinese_part = line.split('(')[0].strip().strip("'").strip().strip('"').strip()  # Remove quotes
-                english_part = line.split('-')[1].strip()
-                # Generate correct pinyin using pypinyin
-                py = pinyin(chinese_part, style=Style.TONE)
-                pinyin_part = ' '.join([''.join(p) for p in py])
-                
-                if (entry['character'] in chinese_part and 
-                    1 < len(chinese_part) <= 8 and 
-                    pinyin_part):
-                    # Reconstruct the line with correct pinyin
-                    valid_line = f"{chinese_part} ({pinyin_part}) - {english_part}"
-                    if valid_line not in valid_examples:
-                        valid_examples.append(valid_line)
-            except (IndexError, Exception):
-                continue
-        
-        # Take up to 3 valid examples
-        valid_examples = valid_examples[:3]
-        
-        # If we have no valid examples, provide a fallback
-        if not valid_examples:
-            print(f"No valid examples found for {entry['character']}")
-            example_field = ""
-            missing_chars.append(entry['character'])
-        else:
-            example_field = '\n'.join(valid_examples)
-        print("valid example")
-        print(example_field)
-
-        note = genanki.Note(
-            model=char_model,
-            fields=[
-                entry['character'],
-                entry['pinyin'],
-                entry['english'],
-                example_field,
-                str(entry['rank'])  # Convert rank to string
-            ])
-        deck.add_note(note)
-        # if count == 5000: 
-        #     break
-
-    # Save the deck to a file
-    package = genanki.Package(deck)
-    # Add the font file to the package
-    package.write_to_file('chinese_characters.apkg')
-    print(f"Created deck with {len(char_data)} characters")
+    # Stream the notes into the package file(s)
+    with meter.phase("package_write", len(char_data)):
+        written = export_notes(notes(), deck, output, delta=delta, shard_size=shard_size)
+    print(f"Created deck with {len(char_data)} characters in {len(written)} package(s)")
     print(f"Missing characters: {missing_chars}")
 
 '''
@@ -0,0 +1,266 @@
+"""Compiled, memory-mapped index of CharFreq.txt with O(1) lookup by character or rank"""
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CharFreq.txt")
+DEFAULT_INDEX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "CharFreq.idx")
+
+ENCODINGS = ["gb18030", "gbk", "gb2312", "utf-8"]  # commonly used for Chinese text
+
+# Sections: header, records (by rank), rank -> slot table, char hash table, UTF-8 strings
+MAGIC = b"CFIX"
+VERSION = 1
+# magic, version, count, max_rank, table_size, records/ranks/chars/strings offsets, source size, source mtime
+HEADER = struct.Struct("<4sIIIIIIIIQd")
+# rank, code point, frequency, cumulative_freq, pinyin offset/length, english offset/length
+RECORD = struct.Struct("<IIIdIIII")
+SLOT = struct.Struct("<I")
+
+CharEntry = namedtuple(
+    "CharEntry", ["rank", "character", "frequency", "cumulative_freq", "pinyin", "english"]
+)
+
+
+def read_rows(path=DEFAULT_SOURCE):
+    """Decode the whole file first, then parse it, so a failed encoding leaves no partial rows"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in ENCODINGS:
+        try:
+            text = raw.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        raise Exception("Could not read file with any of the attempted encodings")
+
+    rows = []
+    for line in text.splitlines():
+        # Skip empty lines or header lines
+        if not line.strip() or line.startswith("/*"):
+            continue
+        parts = line.strip().split("\t")
+        # Minimum required parts: rank, character, frequency, cumulative_freq
+        if len(parts) < 4:
+            continue
+        character = parts[1]
+        # Skip entries with invalid characters
+        if not character.strip() or character.startswith("�"):
+            continue
+        rows.append(
+            CharEntry(
+                rank=int(parts[0]),
+                character=character,
+                frequency=int(parts[2]),
+                cumulative_freq=float(parts[3]),
+                # Handle optional fields with default values
+                pinyin=parts[4] if len(parts) > 4 and parts[4].strip() else "",
+                english=parts[5] if len(parts) > 5 and parts[5].strip() else "",
+            )
+        )
+    rows.sort(key=lambda row: row.rank)
+    return rows
+
+
+def _hash(codepoint, mask):
+    return (codepoint * 2654435761) & mask
+
+
+def compile_index(source=DEFAULT_SOURCE, dest=DEFAULT_INDEX):
+    """Parse CharFreq.txt and write the binary index; returns the number of records"""
+    rows = read_rows(source)
+    for row in rows:
+        if len(row.character) != 1:
+            raise ValueError(f"rank {row.rank}: expected a single character, got {row.character!r}")
+
+    strings = bytearray()
+    records = bytearray()
+    for row in rows:
+        pinyin = row.pinyin.encode("utf-8")
+        english = row.english.encode("utf-8")
+        pinyin_offset = len(strings)
+        strings += pinyin
+        english_offset = len(strings)
+        strings += english
+        records += RECORD.pack(
+            row.rank,
+            ord(row.character),
+            row.frequency,
+            row.cumulative_freq,
+            pinyin_offset,
+            len(pinyin),
+            english_offset,
+            len(english),
+        )
+
+    max_rank = rows[-1].rank if rows else 0
+    ranks = [0] * (max_rank + 1)
+    table_size = 1
+    while table_size < 2 * len(rows):  # load factor <= 0.5
+        table_size *= 2
+    mask = table_size - 1
+    table = [0] * table_size
+    for slot, row in enumerate(rows, start=1):  # slot = record index + 1, 0 marks empty
+        ranks[row.rank] = slot
+        position = _hash(ord(row.character), mask)
+        while table[position]:
+            position = (position + 1) & mask
+        table[position] = slot
+
+    records_offset = HEADER.size
+    ranks_offset = records_offset + len(records)
+    chars_offset = ranks_offset + SLOT.size * len(ranks)
+    strings_offset = chars_offset + SLOT.size * table_size
+    stat = os.stat(source)
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(rows),
+        max_rank,
+        table_size,
+        records_offset,
+        ranks_offset,
+        chars_offset,
+        strings_offset,
+        stat.st_size,
+        stat.st_mtime,
+    )
+    tmp = dest + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(records)
+        f.write(struct.pack(f"<{len(ranks)}I", *ranks))
+        f.write(struct.pack(f"<{table_size}I", *table))
+        f.write(strings)
+    os.replace(tmp, dest)  # never leave a half-written index behind
+    return len(rows)
+
+
+class CharFreqIndex:
+    """Read-only, memory-mapped view of a compiled CharFreq index"""
+
+    def __init__(self, path=DEFAULT_INDEX):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.count,
+            self.max_rank,
+            self.table_size,
+            self._records,
+            self._ranks,
+            self._chars,
+            self._strings,
+            self.source_size,
+            self.source_mtime,
+        ) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} CharFreq index")
+        self._mask = self.table_size - 1
+
+    def _string(self, offset, length):
+        start = self._strings + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def _entry(self, index):
+        rank, codepoint, frequency, cumulative, p_off, p_len, e_off, e_len = RECORD.unpack_from(
+            self._mm, self._records + index * RECORD.size
+        )
+        return CharEntry(
+            rank,
+            chr(codepoint),
+            frequency,
+            cumulative,
+            self._string(p_off, p_len),
+            self._string(e_off, e_len),
+        )
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """Entry at position `index` in rank order"""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._entry(index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._entry(index)
+
+    def __contains__(self, character):
+        return self.by_char(character) is not None
+
+    def by_rank(self, rank):
+        """Entry with this frequency rank, or None"""
+        if not 0 <= rank <= self.max_rank:
+            return None
+        (slot,) = SLOT.unpack_from(self._mm, self._ranks + rank * SLOT.size)
+        return self._entry(slot - 1) if slot else None
+
+    def by_char(self, character):
+        """Entry for a single character, or None"""
+        if len(character) != 1:
+            return None
+        codepoint = ord(character)
+        position = _hash(codepoint, self._mask)
+        while True:
+            (slot,) = SLOT.unpack_from(self._mm, self._chars + position * SLOT.size)
+            if not slot:
+                return None
+            (stored,) = SLOT.unpack_from(self._mm, self._records + (slot - 1) * RECORD.size + 4)
+            if stored == codepoint:
+                return self._entry(slot - 1)
+            position = (position + 1) & self._mask
+
+    def rank_range(self, start, stop):
+        """Entries with start <= rank < stop, in rank order"""
+        return [
+            entry
+            for entry in (self.by_rank(rank) for rank in range(max(start, 0), min(stop, self.max_rank + 1)))
+            if entry is not None
+        ]
+
+    def top(self, n):
+        """The n most frequent characters"""
+        return [self._entry(index) for index in range(min(n, self.count))]
+
+    def close(self):
+        self._mm.close()
+
+
+def is_stale(source=DEFAULT_SOURCE, dest=DEFAULT_INDEX):
+    """True if the index is missing or was compiled from a different CharFreq.txt"""
+    if not os.path.exists(dest):
+        return True
+    try:
+        with open(dest, "rb") as f:
+            header = HEADER.unpack(f.read(HEADER.size))
+    except struct.error:
+        return True
+    magic, version, *_, source_size, source_mtime = header
+    stat = os.stat(source)
+    return (
+        magic != MAGIC
+        or version != VERSION
+        or source_size != stat.st_size
+        or source_mtime != stat.st_mtime
+    )
+
+
+def load_index(source=DEFAULT_SOURCE, dest=DEFAULT_INDEX):
+    """Open the index, compiling it first if it is missing or stale"""
+    if is_stale(source, dest):
+        count = compile_index(source, dest)
+        print(f"Compiled {count} characters into {dest}")
+    return CharFreqIndex(dest)
+
+
+if __name__ == "__main__":
+    print(f"Compiled {compile_index()} characters into {DEFAULT_INDEX}")
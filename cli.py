@@ -0,0 +1,203 @@
+"""Command line entry point for the anki_utils scripts.
+
+Each stage is a subcommand, and modules/resources are only loaded when the chosen
+subcommand needs them, e.g.:
+
+    python cli.py pinyin --deck "All::Mandarin::sentences"
+    python cli.py enrich --stages trad_to_simp update_pinyin update_english --pack-size 8
+    python cli.py spanish-definition --deck "Spanish::Conjugation"
+    python cli.py char-deck --workers 4 --max-ram-gb 24
+    python cli.py english --model http://127.0.0.1:8080 --concurrency 16 --pack-size 8
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+# subcommand -> enrich_subs2srs stage name
+SUBS2SRS_STAGES = {
+    "trad-to-simp": "trad_to_simp",
+    "pinyin": "update_pinyin",
+    "english": "update_english",
+    "definition": "update_target_english_definition",
+}
+
+
+def parse_since(value):
+    """Accept epoch seconds or an ISO date/datetime"""
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp())
+
+
+def add_model_args(parser):
+    parser.add_argument("--model", help="GPT4All model file, or the http(s):// URL of an OpenAI-compatible server")
+    parser.add_argument("--concurrency", type=int, default=8, help="in-flight requests to a server (default: 8)")
+    parser.add_argument("--quiet", action="store_true", help="don't print every item, only progress lines")
+    parser.add_argument("--progress-every", type=float, default=30.0, help="seconds between progress lines (0 = off)")
+    parser.add_argument("--metrics", help="write run metrics here (JSON, or Prometheus textfile if it ends in .prom)")
+
+
+def configure_model(module, args, attr="model_name"):
+    if args.model:
+        setattr(module, attr, args.model)
+    module.concurrency = args.concurrency
+    module.meter.verbose = not args.quiet
+    module.meter.progress_every = args.progress_every
+
+
+def write_metrics(module, args):
+    if args.metrics:
+        module.meter.write(args.metrics)
+        print(f"Wrote metrics to {args.metrics}")
+
+
+def add_collection_args(parser, default_deck):
+    parser.add_argument("--collection", help="path to collection.anki2")
+    parser.add_argument("--deck", default=default_deck, help=f"deck name (default: {default_deck})")
+    parser.add_argument("--dry-run", action="store_true", help="report changes without writing")
+    parser.add_argument("--full", action="store_true", help="ignore incremental state and reprocess every note")
+    add_model_args(parser)
+
+
+def add_enrich_args(parser):
+    add_collection_args(parser, "All::Mandarin::sentences")
+    parser.add_argument("--since", type=parse_since, help="only notes modified after this (epoch or ISO date)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="notes per write transaction")
+    parser.add_argument("--pack-size", type=int, default=1, help="items per translation prompt")
+    parser.add_argument("--no-tm", action="store_true", help="don't consult the translation memory")
+    parser.add_argument(
+        "--tm-similarity", type=float, default=0.7, help="minimum similarity of translation memory matches"
+    )
+
+
+def run_subs2srs(args, stage_names):
+    import enrich_subs2srs
+
+    if args.collection:
+        enrich_subs2srs.col_path = args.collection
+    enrich_subs2srs.deck_name = args.deck
+    configure_model(enrich_subs2srs, args)
+    enrich_subs2srs.use_tm = not args.no_tm
+    enrich_subs2srs.tm_similarity = args.tm_similarity
+    try:
+        enrich_subs2srs.enrich(
+            stage_names,
+            dry_run=args.dry_run,
+            batch_size=args.batch_size,
+            since=args.since,
+            incremental=not args.full,
+            pack_size=args.pack_size,
+        )
+    finally:
+        enrich_subs2srs.close()
+        write_metrics(enrich_subs2srs, args)
+
+
+def run_tm_build(args):
+    import enrich_subs2srs
+
+    if args.collection:
+        enrich_subs2srs.col_path = args.collection
+    enrich_subs2srs.deck_name = args.deck
+    try:
+        enrich_subs2srs.build_translation_memory()
+    finally:
+        enrich_subs2srs.close()
+
+
+def run_spanish(args):
+    import enrich_spanish_conjugation
+
+    if args.collection:
+        enrich_spanish_conjugation.col_path = args.collection
+    enrich_spanish_conjugation.deck_name = args.deck
+    configure_model(enrich_spanish_conjugation, args, attr="model_path")
+    try:
+        enrich_spanish_conjugation.update_target_english_definition(
+            incremental=not args.full,
+            dry_run=args.dry_run,
+            pack_size=args.pack_size,
+        )
+    finally:
+        enrich_spanish_conjugation.close()
+        write_metrics(enrich_spanish_conjugation, args)
+
+
+def run_char_deck(args):
+    import char_deck_creation
+
+    configure_model(char_deck_creation, args)
+    try:
+        char_deck_creation.create_char_deck(
+            resume=not args.no_resume,
+            workers=args.workers,
+            threads=args.threads,
+            max_ram_gb=args.max_ram_gb,
+            pack_size=args.pack_size,
+            retries=args.retries,
+            limit=args.limit,
+            output=args.output,
+            delta=args.delta,
+            shard_size=args.shard_size,
+        )
+    finally:
+        write_metrics(char_deck_creation, args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="anki_utils", description="Enrich Anki decks with local LLMs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, stage_name in SUBS2SRS_STAGES.items():
+        sub = subparsers.add_parser(command, help=f"subs2srs stage {stage_name}")
+        add_enrich_args(sub)
+        sub.set_defaults(func=lambda args, names=[stage_name]: run_subs2srs(args, names))
+
+    sub = subparsers.add_parser("enrich", help="run several subs2srs stages in a single pass")
+    add_enrich_args(sub)
+    sub.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(SUBS2SRS_STAGES.values()),
+        default=list(SUBS2SRS_STAGES.values()),
+    )
+    sub.set_defaults(func=lambda args: run_subs2srs(args, args.stages))
+
+    sub = subparsers.add_parser("tm-build", help="index the deck's translated sentences into the translation memory")
+    sub.add_argument("--collection", help="path to collection.anki2")
+    sub.add_argument("--deck", default="All::Mandarin::sentences")
+    sub.set_defaults(func=run_tm_build)
+
+    sub = subparsers.add_parser("spanish-definition", help="translate Spanish conjugation cloze sentences")
+    add_collection_args(sub, "Spanish::Conjugation")
+    sub.add_argument("--pack-size", type=int, default=1, help="items per translation prompt")
+    sub.set_defaults(func=run_spanish)
+
+    sub = subparsers.add_parser("char-deck", help="build the character frequency deck")
+    sub.add_argument("--workers", type=int, default=1)
+    sub.add_argument("--threads", type=int, help="CPU threads per worker (default: cores / workers)")
+    sub.add_argument("--max-ram-gb", type=float, help="cap on RAM used by model copies")
+    sub.add_argument("--pack-size", type=int, default=1, help="characters per prompt")
+    sub.add_argument("--retries", type=int, default=2, help="extra attempts for characters without examples")
+    sub.add_argument("--no-resume", action="store_true", help="ignore cached model outputs")
+    sub.add_argument("--limit", type=int, help="only the N most frequent characters")
+    sub.add_argument("--output", default="chinese_characters.apkg", help="package path (and shard name prefix)")
+    sub.add_argument("--delta", action="store_true", help="only export notes new or changed since the last build")
+    sub.add_argument("--shard-size", type=int, help="split the export into rank ranges of this many characters")
+    add_model_args(sub)
+    sub.set_defaults(func=run_char_deck)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    args.func(args)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
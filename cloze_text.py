@@ -0,0 +1,103 @@
+"""Single-pass normalizer for cloze note text (the Spanish conjugation deck)"""
+
+import html
+import re
+from functools import lru_cache
+
+NORMALIZE_CACHE_SIZE = 100_000  # distinct card texts kept in the LRU cache
+INTRO_TAGS = ("intro",)  # tags (or tag prefixes, e.g. intro::verbs) marking intro cards
+
+GLYPHS = "{}⇠↧→…〰⊙↬↫()"
+_TOKEN = re.compile(
+    r"(?P<open>\{\{c\d+::)"
+    r"|(?P<sep>::)"
+    r"|(?P<close>\}\})"
+    r"|(?P<tag><[^<]+?>)"
+    r"|(?P<ent>&(?:#\d+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);)"
+    rf"|(?P<drop>[\n{re.escape(GLYPHS)}])"
+    rf"|(?P<text>[^\n:<&{re.escape(GLYPHS)}]+|[:<&])"
+)
+_BREAK_TAG = re.compile(r"</?(?:br|div|p|li|tr|h\d)\b", re.IGNORECASE)
+_CLOZE = re.compile(r"\{\{c\d+::")
+
+_OUTSIDE, _ANSWER, _HINT = 0, 1, 2
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize(text, compat=False):
+    """Plain sentence for a cloze card's text, words separated by single spaces
+
+    Cloze answers are kept, hints dropped and entities decoded. compat=True returns
+    exactly what enrich_spanish_conjugation.process_string did instead.
+    """
+    if compat:
+        return _normalize_compat(text)
+    out = []
+    state = _OUTSIDE
+    for match in _TOKEN.finditer(text):
+        kind = match.lastgroup
+        token = match.group()
+        if kind == "text":
+            if state != _HINT:
+                out.append(token)
+        elif kind == "open":
+            state = _ANSWER
+        elif kind == "sep":
+            if state == _ANSWER:
+                state = _HINT
+            elif state == _OUTSIDE:
+                out.append(token)
+        elif kind == "close":
+            state = _OUTSIDE
+        elif kind == "ent":
+            if state != _HINT:
+                out.append(html.unescape(token))
+        elif kind == "tag":
+            if _BREAK_TAG.match(token):
+                out.append(" ")
+        elif token == "\n":
+            out.append(" ")
+    return " ".join("".join(out).split())
+
+
+def _normalize_compat(text):
+    out = []
+    for match in _TOKEN.finditer(text):
+        kind = match.lastgroup
+        if kind in ("text", "sep", "ent"):
+            out.append(match.group())
+        elif kind == "open":
+            out.append(match.group()[2:])  # the braces are glyphs, "cN::" stays
+    words = "".join(out).split()
+    return " ".join(word.split("::")[1] if "::" in word else word for word in words)
+
+
+def normalize_batch(texts, compat=False):
+    """Normalize a whole list of card texts; repeated texts are only tokenized once"""
+    return [normalize(text, compat) for text in texts]
+
+
+def is_intro(text, tags=()):
+    """Intro / explanation cards: tagged with one of INTRO_TAGS, or without any cloze deletion"""
+    if any(tag.lower().startswith(INTRO_TAGS) for tag in tags):
+        return True
+    return _CLOZE.search(text) is None
+
+
+def select_cards(col, note_ids, field=1):
+    """The note IDs (in order) whose `field` is a cloze card rather than an intro card
+
+    Reads tags and fields for the whole list in one query instead of loading
+    each note.
+    """
+    from anki.utils import ids2str
+
+    rows = col.db.all(f"SELECT id, tags, flds FROM notes WHERE id IN {ids2str(note_ids)}")
+    intro = set()
+    for note_id, tags, flds in rows:
+        fields = flds.split("\x1f")
+        if is_intro(fields[field] if field < len(fields) else "", tags.split()):
+            intro.add(note_id)
+    if intro:
+        print(f"Skipping {len(intro)} intro cards")
+    return [note_id for note_id in note_ids if note_id not in intro]
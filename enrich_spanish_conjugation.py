@@ -1,22 +1,64 @@
-import anki
-from anki.storage import Collection
-from pypinyin import pinyin
-import opencc
-from gpt4all import GPT4All
+from cloze_text import normalize, select_cards
+from enrich_state import EnrichState
+from lazy_resources import LazyResources, open_collection
+from llm_backend import make_backend
+from llm_cache import LLMCache, cached_generate
+from note_pipeline import GroupedStage, run_pipeline
+from prompt_packing import first_line_parser, generate_packed
+from run_metrics import RunMetrics
+import os
 import re
 
-# ! Global variables
+# ! Global variables (the CLI overrides col_path / deck_name)
 col_path = "/Users/zen/Library/Application Support/Anki2/Zen/collection.anki2"  # Path to the Anki collection
-col = Collection(col_path)  # Initialize a new collection
 # deck_name = "subs2srs"  #! deck name
 deck_name = "Spanish::Conjugation"
-deck = col.decks.by_name(deck_name)  # Get deck by name
-notes = col.find_notes(f'"deck:{deck["name"]}"')  # Get the notes from the deck
-model_path = "/Users/zen/Library/Application Support/nomic.ai/GPT4All/Nous-Hermes-2-Mistral-7B-DPO.Q4_0.gguf"
-model = GPT4All(model_path)
+model_path = "/Users/zen/Library/Application Support/nomic.ai/GPT4All/Nous-Hermes-2-Mistral-7B-DPO.Q4_0.gguf"  # or a server URL
+concurrency = 8  # in-flight requests when model_path is a server URL
+meter = RunMetrics("spanish")  # tokens/sec and items/sec of the translations, phase timings and progress
+
+# Heavy resources are created on first use
+resources = LazyResources(
+    model=lambda: make_backend(model_path, concurrency=concurrency),
+    cache=LLMCache,  # on-disk cache of translations, so reruns skip finished prompts
+    state=EnrichState,  # per note/stage input hashes, so reruns skip unchanged notes
+    collection=lambda: open_collection(col_path),
+    stats=("cache",),
+)
+
+
+def get_collection():
+    return resources.get("collection")
+
+
+def get_notes():
+    """Get the notes from the deck"""
+    col = get_collection()
+    deck = col.decks.by_name(deck_name)  # Get deck by name
+    return col.find_notes(f'"deck:{deck["name"]}"')
+
+
+def get_model():
+    return resources.get("model")
+
+
+def get_cache():
+    return resources.get("cache")
+
+
+def get_state():
+    return resources.get("state")
+
+
+def close():
+    """Flush and close whatever resources were opened"""
+    resources.close()
+    if meter.prompts or meter.phases:
+        meter.report()
 
 
 def process_string(text):
+    # Original cleaner, kept as the reference for cloze_text's compat mode
     # Extract the text between curly braces
     # Remove line breaks
     text = text.replace("\n", "")
@@ -39,39 +81,85 @@ def process_string(text):
 
 
 def call_chat(translation_input):
-    print("-----------------------------------")
-    print(f"Original: {translation_input}")
+    meter.log("-----------------------------------")
+    meter.log(f"Original: {translation_input}")
     # Generate the English definition
     enriched_prompt = f"Spanish Sentence: {translation_input}'\nEnglish Translation:"
-    out = model.generate(
+    out = cached_generate(
+        get_model(),
         enriched_prompt,
+        cache=get_cache(),
+        model_name=os.path.basename(model_path),
+        callback=meter.callback,
+        metrics=meter,
         max_tokens=60,
         temp=0,
     )
     english = out.split("\n")[0]
-    print(f"English: {english}")
+    meter.log(f"English: {english}")
     return english
 
 
-def update_target_english_definition():
-    """Add target english definition to notes"""
-    count = 0
-    for note_id in notes:
-        note = col.get_note(note_id)  # Get the note
-        count += 1
-        prompt = note.fields[1]
-        cleaned_prompt = process_string(prompt)
-        if count >= 8:  # skip over intro cards
-            english = call_chat(cleaned_prompt)
-            note.fields[2] = english  # update english definition field
-            col.update_note(note)
+def definition_key(note):
+    """Group notes by their cleaned cloze sentence (answers kept, hints dropped)"""
+    return normalize(note.fields[1])
+
+
+def call_chat_batch(translation_inputs, pack_size):
+    """Translate unique sentences pack_size at a time in numbered prompts"""
+    return generate_packed(
+        get_model(),
+        translation_inputs,
+        "Translate each numbered Spanish sentence to English. Answer with the same "
+        "number in square brackets followed by the English translation, one per line, "
+        "with no additional text.",
+        lambda sentence: sentence,
+        first_line_parser(),  # call_chat also keeps only the first line
+        call_chat,
+        pack_size=pack_size,
+        cache=get_cache(),
+        model_name=os.path.basename(model_path),
+        meter=meter,
+        concurrency=get_model().concurrency,
+        temp=0,
+    )
+
 
-    print(f"Added target english definitions to {count} notes (which had no english).")
+def assign_definition(note, english):
+    if note.fields[2] == english:
+        return False
+    note.fields[2] = english  # update english definition field
+    return True
+
+
+definition_stage = GroupedStage(
+    "spanish_target_english_definition",
+    definition_key,
+    call_chat,
+    assign_definition,
+    compute_batch=call_chat_batch,
+    llm=True,
+    summary="Added target english definitions to {count} notes.",
+    inputs=(1,),
+)
+
+
+def update_target_english_definition(incremental=True, dry_run=False, pack_size=1):
+    """Add target english definition to notes"""
+    definition_stage.pack_size = pack_size
+    return run_pipeline(
+        get_collection(),
+        select_cards(get_collection(), get_notes()),  # skip over intro cards
+        [definition_stage],
+        dry_run=dry_run,
+        state=get_state() if incremental else None,
+        metrics=meter,
+    )
 
 
 def main():
     update_target_english_definition()
-    col.close()
+    close()
 
 
 # if main
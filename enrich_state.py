@@ -0,0 +1,73 @@
+import hashlib
+import sqlite3
+
+DEFAULT_STATE_PATH = "enrich_state.sqlite"
+
+
+def input_hash(fields, indexes):
+    """Hash the fields a stage reads, so edits to them can be detected"""
+    payload = "\x1f".join(fields[i] for i in indexes)  # Anki's own field separator
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class EnrichState:
+    """Per note and stage record of the input hash and note mod time last processed"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS state (
+                note_id INTEGER NOT NULL,
+                stage TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                mod INTEGER NOT NULL,
+                PRIMARY KEY (note_id, stage)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def load(self, stage_names):
+        """Return {(note_id, stage): (input_hash, mod)} for the given stages"""
+        placeholders = ",".join("?" * len(stage_names))
+        rows = self.conn.execute(
+            f"SELECT note_id, stage, input_hash, mod FROM state WHERE stage IN ({placeholders})",
+            list(stage_names),
+        )
+        return {(note_id, stage): (h, mod) for note_id, stage, h, mod in rows}
+
+    def record(self, note_id, stage, input_hash, mod):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO state (note_id, stage, input_hash, mod) VALUES (?, ?, ?, ?)",
+            (note_id, stage, input_hash, mod),
+        )
+
+    def clear(self, stage=None):
+        """Forget processed notes (for one stage, or all), forcing them to be recomputed"""
+        if stage is None:
+            self.conn.execute("DELETE FROM state")
+        else:
+            self.conn.execute("DELETE FROM state WHERE stage = ?", (stage,))
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def note_mods(col, note_ids, chunk_size=5000):
+    """Read note mod times straight from the notes table, without loading notes"""
+    mods = {}
+    for i in range(0, len(note_ids), chunk_size):
+        chunk = note_ids[i:i + chunk_size]
+        placeholders = ",".join("?" * len(chunk))
+        for note_id, mod in col.db.all(
+            f"select id, mod from notes where id in ({placeholders})", *chunk
+        ):
+            mods[note_id] = mod
+    return mods
@@ -1,127 +1,385 @@
-import anki
-from anki.storage import Collection
-from pypinyin import pinyin
-import opencc
-from gpt4all import GPT4All
+from enrich_state import EnrichState
+from lazy_resources import LazyResources, open_collection
+from llm_backend import make_backend
+from llm_cache import LLMCache, cached_generate
+from note_pipeline import GroupedStage, run_pipeline
+from note_selection import FieldEmpty, FieldEquals, FieldNotEmpty, select_for_stages, select_notes
+from prompt_packing import first_line_parser, generate_packed
+from run_metrics import RunMetrics
+import text_norm
+from translation_memory import TranslationMemory
 
-# ! Global variables
+# ! Global variables (the CLI overrides col_path / deck_name)
 col_path = "/Users/zen/Library/Application Support/Anki2/Zen/collection.anki2"  # Path to the Anki collection
-col = Collection(col_path)  # Initialize a new collection
 # deck_name = "subs2srs"  #! deck name
 deck_name = "All::Mandarin::sentences"
-deck = col.decks.by_name(deck_name)  # Get deck by name
-notes = col.find_notes(f'"deck:{deck["name"]}"')  # Get the notes from the deck
-converter = opencc.OpenCC(
-    "t2s"
-)  # instantiate OpenCC traditional to simplified converter
-model = GPT4All(
-    model_name="mistral-7b-instruct-v0.1.Q4_0.gguf", verbose=True
-)  # instantiate GPT4All
+model_name = "mistral-7b-instruct-v0.1.Q4_0.gguf"  # or the URL of an OpenAI-compatible server
+concurrency = 8  # in-flight requests when model_name is a server URL
+meter = RunMetrics("subs2srs")  # tokens/sec and items/sec of the LLM stages, phase timings and progress
+use_tm = True  # reuse/offer earlier translations of the same or similar sentences
+tm_similarity = 0.7  # minimum character-bigram similarity for a translation memory match
 
+# Heavy resources are created on first use, so stages that don't need them start fast
+resources = LazyResources(
+    model=lambda: make_backend(model_name, concurrency=concurrency, verbose=True),
+    cache=LLMCache,  # on-disk cache of translations, so reruns skip finished prompts
+    tm=lambda: TranslationMemory(similarity=tm_similarity),
+    state=EnrichState,  # per note/stage input hashes, so reruns skip unchanged notes
+    collection=lambda: open_collection(col_path),
+    stats=("cache", "tm"),
+)
 
-def trad_to_simp():
+
+def get_collection():
+    return resources.get("collection")
+
+
+def get_model():
+    return resources.get("model")
+
+
+def get_cache():
+    return resources.get("cache")
+
+
+def get_state():
+    return resources.get("state")
+
+
+def get_tm():
+    """The translation memory, or None when it is turned off"""
+    return resources.get("tm") if use_tm else None
+
+
+def close():
+    """Flush and close whatever resources were opened"""
+    resources.close()
+    if meter.prompts or meter.phases:
+        meter.report()
+
+
+def simplify_key(note):
+    """Group notes by their hanzi sentence"""
+    return note.fields[2]  # og hanzi
+
+
+def assign_simplified(note, simplified_sentence):
+    if simplified_sentence == note.fields[2]:  # already simplified, nothing to write
+        return False
+    # print("-----------------------------------")
+    # print("Found traditional characters in note: ")
+    # print(f"Original: {note.fields[2]}")
+    # print(f"Simplified: {simplified_sentence}")
+    note.fields[2] = simplified_sentence  # update original field
+    return True
+
+
+def pinyin_key(note):
+    """Group notes which have no pinyin by their simplified sentence"""
+    if note.fields[4] != "":  # pinyin
+        return None
+    return note.fields[2]  # og hanzi
+
+
+def assign_pinyin(note, pinyin_string):
+    # print("-----------------------------------")
+    # print(f"Original: {note.fields[2]}")
+    # print(f"Pinyin: {pinyin_string}")
+    note.fields[4] = pinyin_string  # update pinyin field
+    return True
+
+
+def normalize_text(text):
+    """Normalize an LLM input so identical lines/words group together"""
+    return " ".join(text.split())
+
+
+def english_key(note):
+    """Group notes without english by their simplified sentence"""
+    if note.fields[5] != "":  # english
+        return None
+    return normalize_text(note.fields[2])  # og hanzi
+
+
+def strip_answer_prefix(english):
+    """Remove an "Answer:" style prefix from english if it is there"""
+    if ":" in english:
+        english = english.split(":")[1].strip()
+    return english
+
+
+# Packed answers get the same clean-up as single prompts
+_first_line_answer = first_line_parser(strip_answer_prefix)
+
+
+def translate_sentence(simplified_sentence, examples=()):
+    """Translate one (unique) simplified sentence to english
+
+    `examples` are translation memory matches shown to the model as few-shot context.
+    """
+    prompt = f"Translate the Chinese sentence '{simplified_sentence}' to English."
+    if examples:
+        shots = "\n".join(f"Chinese: {match.source}\nEnglish: {match.target}" for match in examples)
+        prompt = f"Translations of similar sentences:\n{shots}\n\n{prompt}"
+    english = cached_generate(
+        get_model(),
+        prompt,
+        cache=get_cache(),
+        model_name=model_name,
+        callback=meter.callback,
+        metrics=meter,
+        max_tokens=60,
+        temp=0.8,
+    )
+    english = strip_answer_prefix(english)
+    meter.log("-----------------------------------")
+    meter.log(f"Original: {simplified_sentence}")
+    meter.log(f"English: {english}")
+    return english
+
+
+def translate_sentences(simplified_sentences, pack_size):
+    """Translate unique sentences, consulting the translation memory first
+
+    A sentence already in the memory (ignoring punctuation and spacing) reuses its
+    translation; one with near matches gets them as examples in its own prompt; the
+    rest are translated pack_size at a time in numbered prompts.
+    """
+    tm = get_tm()
+    translations = {}
+    near = {}
+    fresh = []
+    for sentence in simplified_sentences:
+        with meter.phase("tm_lookup"):
+            matches = tm.lookup(sentence) if tm is not None else []
+        if matches and matches[0].exact:
+            meter.count("tm_reuses")
+            translations[sentence] = matches[0].target
+        elif matches:
+            near[sentence] = matches
+        else:
+            fresh.append(sentence)
+
+    if near:
+        # pack_size=1 sends each sentence through `single`, with its own examples
+        translations.update(zip(near, generate_packed(
+            get_model(),
+            list(near),
+            "",
+            lambda sentence: sentence,
+            _first_line_answer,
+            lambda sentence: translate_sentence(sentence, near[sentence]),
+            pack_size=1,
+            meter=meter,
+            concurrency=get_model().concurrency,
+        )))
+        meter.count("tm_near_matches", len(near))
+    if fresh:
+        translations.update(zip(fresh, _translate_packed(fresh, pack_size)))
+
+    if tm is not None:
+        for sentence in near.keys() | set(fresh):
+            tm.add(sentence, translations[sentence])
+        tm.commit()
+    return [translations[sentence] for sentence in simplified_sentences]
+
+
+def _translate_packed(simplified_sentences, pack_size):
+    return generate_packed(
+        get_model(),
+        simplified_sentences,
+        "Translate each numbered Chinese sentence to English. Answer with the same "
+        "number in square brackets followed by the English translation, one per line, "
+        "with no additional text.",
+        lambda sentence: sentence,
+        _first_line_answer,
+        translate_sentence,
+        pack_size=pack_size,
+        cache=get_cache(),
+        model_name=model_name,
+        meter=meter,
+        concurrency=get_model().concurrency,
+        temp=0.8,
+    )
+
+
+def assign_english(note, english):
+    note.fields[5] = english  # update english field
+    return True
+
+
+def target_definition_key(note):
+    """Group notes with exactly one unknown by that target word"""
+    # 11 am-unknowns
+    # 12 am-unknowns-count
+    if note.fields[12] != "1":  # am-unknowns-count
+        return None
+    return normalize_text(note.fields[11])  # am-unknowns
+
+
+def translate_word(am_target):
+    """Translate one (unique) target word to english"""
+    english = cached_generate(
+        get_model(),
+        f"Translate the Chinese word '{am_target}' to English.",
+        cache=get_cache(),
+        model_name=model_name,
+        callback=meter.callback,
+        metrics=meter,
+        max_tokens=60,
+        temp=0.8,
+    )
+    english = strip_answer_prefix(english)
+    meter.log("-----------------------------------")
+    meter.log(f"Original: {am_target}")
+    meter.log(f"English: {english}")
+    return english
+
+
+def translate_words(am_targets, pack_size):
+    """Translate unique target words pack_size at a time in numbered prompts"""
+    return generate_packed(
+        get_model(),
+        am_targets,
+        "Translate each numbered Chinese word to English. Answer with the same "
+        "number in square brackets followed by the English meaning, one per line, "
+        "with no additional text.",
+        lambda word: word,
+        _first_line_answer,
+        translate_word,
+        pack_size=pack_size,
+        cache=get_cache(),
+        model_name=model_name,
+        meter=meter,
+        max_tokens_per_item=30,
+        concurrency=get_model().concurrency,
+        temp=0.8,
+    )
+
+
+def assign_target_definition(note, english):
+    if note.fields[10] == english:
+        return False
+    note.fields[10] = english  # update english definition field
+    return True
+
+
+# Stages in the order a full run applies them
+STAGES = {
+    "trad_to_simp": GroupedStage(
+        "trad_to_simp",
+        simplify_key,
+        text_norm.to_simplified,
+        assign_simplified,
+        compute_batch=lambda sentences, pack_size: text_norm.to_simplified_batch(sentences),
+        summary="Converted traditional characters to simplified in {count} notes.",
+        inputs=(2,),
+    ),
+    "update_pinyin": GroupedStage(
+        "update_pinyin",
+        pinyin_key,
+        text_norm.to_pinyin,
+        assign_pinyin,
+        compute_batch=lambda sentences, pack_size: text_norm.to_pinyin_batch(sentences),
+        summary="Added pinyin to {count} notes (which had no pinyin).",
+        select=[FieldEmpty(4)],
+        inputs=(2, 4),
+    ),
+    "update_english": GroupedStage(
+        "update_english",
+        english_key,
+        translate_sentence,
+        assign_english,
+        compute_batch=translate_sentences,
+        llm=True,
+        summary="Added english to {count} notes (which had no english).",
+        select=[FieldEmpty(5)],
+        inputs=(2, 5),
+    ),
+    "update_target_english_definition": GroupedStage(
+        "update_target_english_definition",
+        target_definition_key,
+        translate_word,
+        assign_target_definition,
+        compute_batch=translate_words,
+        llm=True,
+        summary="Added target english definitions to {count} notes.",
+        select=[FieldEquals(12, "1")],
+        inputs=(11, 12),
+    ),
+}
+
+
+def enrich(
+    stage_names=tuple(STAGES),
+    dry_run=False,
+    batch_size=1000,
+    since=None,
+    incremental=True,
+    pack_size=1,
+):
+    """Run the selected stages over the deck in a single pass
+
+    Only candidate notes (selected in the collection, not in Python) are loaded;
+    `since` (epoch seconds) further limits them to notes modified after that time.
+    With incremental=True, notes unchanged since the last run are skipped.
+    pack_size > 1 packs that many unique inputs into each translation prompt.
+    """
+    stages = [STAGES[name] for name in stage_names]
+    for stage in stages:
+        stage.pack_size = pack_size
+    col = get_collection()
+    note_ids = select_for_stages(col, deck_name, stages, since=since)
+    print(f"Selected {len(note_ids)} candidate notes.")
+    return run_pipeline(
+        col,
+        note_ids,
+        stages,
+        dry_run=dry_run,
+        batch_size=batch_size,
+        state=get_state() if incremental else None,
+        metrics=meter,
+    )
+
+
+def build_translation_memory():
+    """Index the deck's already translated sentences into the translation memory"""
+    col = get_collection()
+    tm = TranslationMemory(similarity=tm_similarity)
+    note_ids = select_notes(col, deck_name, [FieldNotEmpty(5)])  # english
+    before = len(tm)
+    tm.add_many(
+        (note.fields[2], note.fields[5])  # og hanzi, english
+        for note in (col.get_note(note_id) for note_id in note_ids)
+    )
+    print(f"Indexed {len(tm) - before} new sentences from {len(note_ids)} translated notes ({len(tm)} total).")
+    tm.close()
+
+
+def trad_to_simp(dry_run=False):
     """Convert traditional chinese to simplified chinese"""
-    count = 0
-    for note_id in notes:
-        note = col.get_note(note_id)  # Get the note
-        original_sentence = note.fields[2]  # og hanzi
-        simplified_sentence = converter.convert(
-            original_sentence
-        )  # convert to simplified
-        # # Look at original_sentence and check if it has traditional characters, if it does, convert to simplified
-        if simplified_sentence != original_sentence:
-            count += 1
-            # print("-----------------------------------")
-            # print("Found traditional characters in note: ")
-            # print(f"Original: {original_sentence}")
-            # print(f"Simplified: {simplified_sentence}")
-        note.fields[2] = simplified_sentence  # update original field
-        col.update_note(note)  #! update note
-    print(f"Converted traditional characters to simplified in {count} notes.")
-
-
-def update_pinyin():
+    return enrich(["trad_to_simp"], dry_run=dry_run)
+
+
+def update_pinyin(dry_run=False):
     """Add pinyin to notes"""
-    count = 0
-    for note_id in notes:
-        note = col.get_note(note_id)  # Get the note
-        if note.fields[4] != "":  # pinyin
-            continue
-        count += 1
-        simplified_sentence = note.fields[2]  # og hanzi
-        pinyin_string = " ".join(  # determine pinyin
-            item for sublist in pinyin(simplified_sentence) for item in sublist
-        )
-        # print("-----------------------------------")
-        # print(f"Original: {simplified_sentence}")
-        # print(f"Pinyin: {pinyin_string}")
-        note.fields[4] = pinyin_string  # update pinyin field
-        col.update_note(note)  #! update note
-    print(f"Added pinyin to {count} notes (which had no pinyin).")
-
-
-def update_english():
+    return enrich(["update_pinyin"], dry_run=dry_run)
+
+
+def update_english(dry_run=False):
     """Add english to notes"""
-    count = 0
-    for note_id in notes:
-        note = col.get_note(note_id)  # Get the note
-        if note.fields[5] != "":  # english
-            continue
-        count += 1
-        simplified_sentence = note.fields[2]  # og hanzi
-        english = model.generate(
-            f"Translate the Chinese sentence '{simplified_sentence}' to English.",
-            max_tokens=60,
-            temp=0.8,
-        )
-        # remove "Answer:" prefix from english if it is there:
-        if ":" in english:
-            english = english.split(":")[1].strip()
-        print("-----------------------------------")
-        print(f"Original: {simplified_sentence}")
-        print(f"English: {english}")
-        note.fields[5] = english  # update english field
-        col.update_note(note)  #! update note
-        # if count == 10:
-        #     break
-    print(f"Added english to {count} notes (which had no english).")
-
-
-def update_target_english_definition():
+    return enrich(["update_english"], dry_run=dry_run)
+
+
+def update_target_english_definition(dry_run=False):
     """Add target english definition to notes"""
-    count = 0
-    for note_id in notes:
-        note = col.get_note(note_id)  # Get the note
-        # 11 am-unknowns
-        # 12 am-unknowns-count
-        am_target = note.fields[11]  # am-unknowns
-        am_target_count = note.fields[12]  # am-unknowns-count
-        if am_target_count == "1":  # if there are no unknowns
-            count += 1
-            english = model.generate(
-                f"Translate the Chinese word '{am_target}' to English.",
-                max_tokens=60,
-                temp=0.8,
-            )
-            # remove "Answer:" prefix from english if it is there:
-            if ":" in english:
-                english = english.split(":")[1].strip()
-            print("-----------------------------------")
-            print(f"Original: {am_target}")
-            print(f"English: {english}")
-            note.fields[10] = english  # update english definition field
-            col.update_note(note)  #! update note
-        # if count == 10:
-        #     break
-    print(f"Added target english definitions to {count} notes (which had no english).")
+    return enrich(["update_target_english_definition"], dry_run=dry_run)
 
 
 def main():
-    # trad_to_simp()
-    # update_pinyin()
-    # update_english()
+    # enrich(["trad_to_simp", "update_pinyin", "update_english"])
     update_target_english_definition()
-    col.close()
+    close()
 
 
 # if main
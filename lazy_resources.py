@@ -0,0 +1,37 @@
+class LazyResources:
+    """Heavy resources (collection, model, caches) created on first use and closed together
+
+    Each keyword argument is a zero-argument factory; close() closes what was
+    opened in the order the factories were given, printing stats() for the names
+    listed in `stats`.
+    """
+
+    def __init__(self, stats=(), **factories):
+        self.factories = factories
+        self.stats = stats
+        self.opened = {}
+
+    def get(self, name):
+        if name not in self.opened:
+            self.opened[name] = self.factories[name]()
+        return self.opened[name]
+
+    def set(self, name, resource):
+        """Use a ready resource instead of the factory (e.g. a benchmark stub model)"""
+        self.opened[name] = resource
+
+    def close(self):
+        """Flush and close whatever resources were opened"""
+        for name in self.factories:
+            resource = self.opened.pop(name, None)
+            if resource is None:
+                continue
+            resource.close()
+            if name in self.stats:
+                print(resource.stats())
+
+
+def open_collection(path):
+    from anki.storage import Collection
+
+    return Collection(path)  # Open the collection
@@ -0,0 +1,268 @@
+"""Text generation backends exposing GPT4All's generate(prompt, callback=None, **params)"""
+
+import asyncio
+import json
+import random
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+
+class BackendError(Exception):
+    """The inference server returned an error that retrying will not fix"""
+
+
+class GPT4AllBackend:
+    """In-process GPT4All model (one generation at a time)"""
+
+    concurrency = 1
+
+    def __init__(self, model_name, **kwargs):
+        self.name = model_name
+        self.kwargs = kwargs  # passed to GPT4All(), e.g. n_threads, verbose
+        self._model = None
+        self._lock = threading.Lock()  # the native model is not thread safe
+
+    @property
+    def model(self):
+        if self._model is None:
+            from gpt4all import GPT4All
+
+            self._model = GPT4All(model_name=self.name, **self.kwargs)
+        return self._model
+
+    def generate(self, prompt, callback=None, **params):
+        with self._lock:
+            if callback is not None:
+                return self.model.generate(prompt, callback=callback, **params)
+            return self.model.generate(prompt, **params)
+
+    def close(self):
+        if self._model is not None and hasattr(self._model, "close"):
+            self._model.close()
+        self._model = None
+
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one host, reused across requests"""
+
+    def __init__(self, host, port, use_ssl=False, size=8):
+        self.host = host
+        self.port = port
+        self.ssl = ssl.create_default_context() if use_ssl else None
+        self.size = size
+        self._idle = []
+
+    async def acquire(self):
+        """Return (reader, writer, reused)"""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable):
+        if reusable and len(self._idle) < self.size and not writer.is_closing():
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class OpenAIServerBackend:
+    """Client for an OpenAI-compatible completions server (llama.cpp server or similar)"""
+
+    def __init__(
+        self,
+        base_url="http://127.0.0.1:8080",
+        model="",
+        concurrency=8,  # requests in flight over pooled connections, so the server can batch them
+        retries=3,  # for connection errors, 429 and 5xx, with exponential backoff
+        backoff=0.5,
+        timeout=300.0,
+    ):
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.path = parts.path.rstrip("/") + "/v1/completions"
+        self.name = model or base_url
+        self.model = model
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        use_ssl = parts.scheme == "https"
+        port = parts.port or (443 if use_ssl else 80)
+        self._host_header = parts.netloc
+        self._pool = ConnectionPool(parts.hostname, port, use_ssl, size=concurrency)
+        # private event loop in a background thread, so generate() can be called from many threads
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._semaphore = None  # created on the loop
+
+    def generate(self, prompt, callback=None, max_tokens=200, temp=0.0, **params):
+        future = asyncio.run_coroutine_threadsafe(
+            self.agenerate(prompt, callback=callback, max_tokens=max_tokens, temp=temp, **params),
+            self._loop,
+        )
+        return future.result()
+
+    def generate_many(self, prompts, **params):
+        """Run all prompts concurrently (bounded by `concurrency`), results in order"""
+
+        async def gather():
+            return await asyncio.gather(*(self.agenerate(prompt, **params) for prompt in prompts))
+
+        return asyncio.run_coroutine_threadsafe(gather(), self._loop).result()
+
+    async def agenerate(self, prompt, callback=None, max_tokens=200, temp=0.0, **params):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        payload = {
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temp,
+            "stream": callback is not None,
+            **params,
+        }
+        if self.model:
+            payload["model"] = self.model
+        body = json.dumps(payload).encode("utf-8")
+        delivered = False
+
+        def tracked(token_id, token):
+            nonlocal delivered
+            delivered = True
+            return callback(token_id, token)
+
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    return await asyncio.wait_for(
+                        self._request(body, tracked if callback is not None else None), self.timeout
+                    )
+                except (_RetryableError, ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, OSError) as e:
+                    if delivered:  # the callback already saw tokens, a retry would replay them
+                        raise BackendError(f"stream failed after tokens were delivered: {e!r}") from e
+                    if attempt == self.retries:
+                        raise BackendError(f"giving up after {attempt + 1} attempts: {e!r}") from e
+                    delay = self.backoff * (2 ** attempt)
+                    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+    async def _request(self, body, callback):
+        reader, writer, reused = await self._pool.acquire()
+        reusable = False
+        try:
+            writer.write(
+                (
+                    f"POST {self.path} HTTP/1.1\r\n"
+                    f"Host: {self._host_header}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: keep-alive\r\n\r\n"
+                ).encode("ascii")
+                + body
+            )
+            await writer.drain()
+            try:
+                status, headers = await self._read_head(reader)
+            except asyncio.IncompleteReadError:
+                if reused:  # the server closed an idle keep-alive connection
+                    raise _RetryableError("stale pooled connection")
+                raise
+            keep_alive = headers.get("connection", "").lower() != "close" and (
+                "content-length" in headers or "transfer-encoding" in headers
+            )
+            if status != 200:
+                data = b"".join([piece async for piece in self._read_body(reader, headers)])
+                reusable = keep_alive
+                message = f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}"
+                if status == 429 or status >= 500:
+                    raise _RetryableError(message)
+                raise BackendError(message)
+            if callback is None:
+                data = b"".join([piece async for piece in self._read_body(reader, headers)])
+                reusable = keep_alive
+                return json.loads(data)["choices"][0]["text"]
+            text, finished = await self._read_stream(reader, headers, callback)
+            reusable = keep_alive and finished
+            return text
+        finally:
+            self._pool.release(reader, writer, reusable)
+
+    @staticmethod
+    async def _read_head(reader):
+        status_line = await reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                return status, headers
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        """Yield the response body, handling chunked and Content-Length framing"""
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b"\r\n") != b"\r\n":  # trailers
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)  # CRLF after each chunk
+        elif "content-length" in headers:
+            yield await reader.readexactly(int(headers["content-length"]))
+        else:
+            yield await reader.read()
+
+    async def _read_stream(self, reader, headers, callback):
+        """Consume a server-sent event stream; returns (text, finished)"""
+        text = []
+        buffer = b""
+        async for piece in self._read_body(reader, headers):
+            buffer += piece
+            while b"\n\n" in buffer:
+                event, buffer = buffer.split(b"\n\n", 1)
+                for line in event.split(b"\n"):
+                    if not line.startswith(b"data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == b"[DONE]":
+                        continue
+                    token = json.loads(data)["choices"][0].get("text", "")
+                    text.append(token)
+                    if callback(0, token) is False:
+                        return "".join(text), False  # stopped mid-stream, drop the connection
+        return "".join(text), True
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._pool.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def is_server(spec):
+    return spec.startswith(("http://", "https://"))
+
+
+def make_backend(spec, model="", concurrency=8, **gpt4all_kwargs):
+    """A GPT4All model name/path, or an http(s):// URL of an OpenAI-compatible server
+
+    `model` and `concurrency` apply to servers, other keyword arguments to GPT4All().
+    """
+    if is_server(spec):
+        return OpenAIServerBackend(spec, model=model, concurrency=concurrency)
+    return GPT4AllBackend(spec, **gpt4all_kwargs)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = "llm_cache.sqlite"
+
+
+class LLMCache:
+    """On-disk cache of LLM outputs keyed by model name, prompt and generation parameters"""
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        max_bytes=512 * 1024 * 1024,
+        checkpoint_every=50,
+        resume=True,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes  # evict least recently used entries above this size
+        self.checkpoint_every = checkpoint_every  # flush access times / evict every N entries
+        self.resume = resume  # when False, ignore existing entries (but still record new ones)
+        self.pending = 0
+        self.accessed = {}  # key -> last access time, written in one short batch
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # generate may be called from several threads
+        # Each write is its own short transaction, so several processes can share the file
+        self.conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                output TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+        )
+
+    @staticmethod
+    def make_key(model_name, prompt, **params):
+        """Hash the model name, prompt and generation parameters into a cache key"""
+        payload = json.dumps(
+            [model_name, prompt, sorted(params.items())], ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model_name, prompt, **params):
+        """Return the cached output, or None if this prompt was never finished"""
+        if not self.resume:
+            with self._lock:
+                self.misses += 1
+            return None
+        key = self.make_key(model_name, prompt, **params)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT output FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.accessed[key] = time.time()
+            flush = len(self.accessed) >= self.checkpoint_every
+        if flush:
+            self.flush_accessed()
+        return row[0]
+
+    def put(self, model_name, prompt, output, **params):
+        """Record an output, committed straight away; evicts every `checkpoint_every` entries"""
+        key = self.make_key(model_name, prompt, **params)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (key, model, output, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, output, len(output.encode("utf-8")), now, now),
+            )
+            self.accessed.pop(key, None)
+            self.pending += 1
+            due = self.pending >= self.checkpoint_every
+        if due:
+            self.checkpoint()
+
+    def flush_accessed(self):
+        """Write batched access times in one short transaction"""
+        with self._lock:
+            self._flush_accessed()
+
+    def _flush_accessed(self):
+        if not self.accessed:
+            return
+        rows = [(t, key) for key, t in self.accessed.items()]
+        self.accessed = {}
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("UPDATE entries SET accessed = ? WHERE key = ?", rows)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            return self._evict()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        rows = self.conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed ASC"
+        ).fetchall()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                evicted += 1
+        return evicted
+
+    def checkpoint(self):
+        """Flush access times and evict if needed"""
+        with self._lock:
+            self._flush_accessed()
+            self._evict()
+            self.pending = 0
+
+    def clear(self, model_name=None):
+        """Remove all entries (or only those for one model)"""
+        with self._lock:
+            self.accessed = {}
+            if model_name is None:
+                self.conn.execute("DELETE FROM entries")
+            else:
+                self.conn.execute("DELETE FROM entries WHERE model = ?", (model_name,))
+
+    def stats(self):
+        return f"LLM cache: {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        self.checkpoint()
+        self.conn.close()
+
+
+def cached_generate(
+    model, prompt, cache=None, model_name="", callback=None, metrics=None, cache_if=None, **params
+):
+    """Call model.generate, reusing a cached output for the same model/prompt/params
+
+    `callback` is passed through to generate (per-token hook) and is not part of the key.
+    A new output is only stored if `cache_if(output)` is true (when given).
+    With `metrics` (a RunMetrics), cache hits/misses are counted and generation time
+    is split into llm_prefill (until the first token) and llm_decode.
+    """
+    if cache is not None:
+        output = cache.get(model_name, prompt, **params)
+        if metrics is not None:
+            metrics.count("cache_hits" if output is not None else "cache_misses")
+        if output is not None:
+            return output
+    output = _generate(model, prompt, callback, metrics, params)
+    if cache is not None and (cache_if is None or cache_if(output)):
+        cache.put(model_name, prompt, output, **params)
+    return output
+
+
+def _generate(model, prompt, callback, metrics, params):
+    if metrics is None:
+        if callback is None:
+            return model.generate(prompt, **params)
+        return model.generate(prompt, callback=callback, **params)
+
+    start = time.perf_counter()
+    first_token = None
+
+    def timed_callback(token_id, response):
+        nonlocal first_token
+        if first_token is None:
+            first_token = time.perf_counter()
+        return callback(token_id, response) if callback is not None else True
+
+    output = model.generate(prompt, callback=timed_callback, **params)
+    end = time.perf_counter()
+    first_token = first_token or end
+    metrics.record("llm_prefill", first_token - start)
+    metrics.record("llm_decode", end - first_token)
+    return output
@@ -0,0 +1,201 @@
+import time
+
+from enrich_state import input_hash, note_mods
+
+
+class Stage:
+    """One enrichment step that updates a note's fields in place"""
+
+    def __init__(
+        self,
+        name,
+        apply,
+        summary="{name} changed {count} notes.",
+        select=(),
+        inputs=(),
+    ):
+        self.name = name
+        self.apply = apply  # apply(note) -> True if it changed the note
+        self.summary = summary  # printed after the run, formatted with name and count
+        self.select = select  # note_selection criteria for candidate notes (empty = all)
+        self.inputs = inputs  # field indexes the stage reads, hashed for incremental runs
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+
+class GroupedStage(Stage):
+    """A stage whose expensive work runs once per unique input key, shared by every note with that key"""
+
+    def __init__(self, name, key, compute, assign, compute_batch=None, pack_size=1, llm=False, **kwargs):
+        super().__init__(name, None, **kwargs)
+        self.key = key  # key(note) -> normalized input, or None if the note needs nothing
+        self.compute = compute  # compute(key) -> result
+        self.assign = assign  # assign(note, result) -> True if it changed the note
+        self.compute_batch = compute_batch  # compute_batch(keys, pack_size) -> results, for a chunk's new keys
+        self.pack_size = pack_size
+        self.llm = llm  # compute calls the LLM, so a dry run only counts its groups
+        self.reset()
+
+    def reset(self):
+        """Forget the results and counts of a previous run"""
+        self.results = {}  # key -> result, shared across chunks
+        self.planned = set()  # keys a dry run would have computed
+        self.requests = 0  # notes that needed a result
+        self.compute_seconds = 0.0
+
+    def run(self, notes):
+        """Compute each unique key once and assign the results; returns the changed count"""
+        groups = {}
+        for note in notes:
+            key = self.key(note)
+            if key is not None:
+                groups.setdefault(key, []).append(note)
+        new_keys = [key for key in groups if key not in self.results]
+        if self.compute_batch is not None and new_keys:
+            start = time.perf_counter()
+            self.results.update(zip(new_keys, self.compute_batch(new_keys, self.pack_size)))
+            self.compute_seconds += time.perf_counter() - start
+        changed = 0
+        for key, group in groups.items():
+            self.requests += len(group)
+            if key not in self.results:
+                start = time.perf_counter()
+                self.results[key] = self.compute(key)
+                self.compute_seconds += time.perf_counter() - start
+            for note in group:
+                if self.assign(note, self.results[key]):
+                    changed += 1
+        return changed
+
+    def plan(self, notes):
+        """Count the notes and unique keys run() would compute, without computing them"""
+        for note in notes:
+            key = self.key(note)
+            if key is not None:
+                self.requests += 1
+                if key not in self.results:
+                    self.planned.add(key)
+
+    def report(self):
+        unique = len(self.results)
+        if not self.requests:
+            return
+        if self.planned:  # dry run
+            print(
+                f"  {self.name}: {self.requests} candidate notes, "
+                f"{len(self.planned)} groups to generate (skipped in dry run)"
+            )
+            return
+        ratio = self.requests / unique if unique else 0.0
+        saved = self.requests - unique
+        seconds_saved = saved * (self.compute_seconds / unique) if unique else 0.0
+        print(
+            f"  {self.name}: {self.requests} notes, {unique} unique inputs "
+            f"(dedup ratio {ratio:.2f}x, ~{seconds_saved:.1f}s compute saved)"
+        )
+
+
+def flush_notes(col, pending):
+    """Write a batch of changed notes in a single transaction"""
+    if pending:
+        col.update_notes(pending)
+
+
+def _record_state(col, state, stages, processed, written_ids):
+    """Record input hashes with the notes' mod times as they are after writing"""
+    if not processed:
+        return
+    mods = note_mods(col, written_ids) if written_ids else {}
+    for note_id, mod, fields in processed:
+        mod = mods.get(note_id, mod)
+        for stage in stages:
+            state.record(note_id, stage.name, input_hash(fields, stage.inputs), mod)
+    state.commit()
+
+
+def run_pipeline(col, note_ids, stages, dry_run=False, batch_size=1000, state=None, metrics=None):
+    """Load each note once, run the stages in order and batch-write only changed notes"""
+    for stage in stages:
+        if isinstance(stage, GroupedStage):
+            stage.reset()  # stages are module-level, so a second run starts clean
+    counts = {stage.name: 0 for stage in stages}
+    unchanged = {stage.name: 0 for stage in stages}
+    changed = 0
+    skipped = 0
+
+    previous = {}
+    mods = {}
+    if state is not None:
+        previous = state.load([stage.name for stage in stages])
+        mods = note_mods(col, list(note_ids))
+
+    def is_unchanged(note, stage):
+        entry = previous.get((note.id, stage.name))
+        return entry is not None and entry[0] == input_hash(note.fields, stage.inputs)
+
+    if metrics is not None:
+        metrics.start(total=len(note_ids))
+
+    # chunks of batch_size: every stage runs over the whole chunk (so grouped stages
+    # dedup across it), then the changed notes are written in one transaction
+    for i in range(0, len(note_ids), batch_size):
+        chunk = []
+        load_start = time.perf_counter()
+        for note_id in note_ids[i:i + batch_size]:
+            if state is not None:
+                mod = mods.get(note_id)
+                seen = [previous.get((note_id, stage.name)) for stage in stages]
+                if all(entry is not None and entry[1] == mod for entry in seen):
+                    skipped += 1  # untouched since we last processed it
+                    continue
+            chunk.append(col.get_note(note_id))
+        before = [list(note.fields) for note in chunk]
+        if metrics is not None:
+            metrics.record("note_load", time.perf_counter() - load_start, len(chunk))
+
+        for stage in stages:
+            todo = chunk
+            if state is not None:
+                todo = [note for note in chunk if not is_unchanged(note, stage)]
+                unchanged[stage.name] += len(chunk) - len(todo)
+            stage_start = time.perf_counter()
+            if isinstance(stage, GroupedStage) and dry_run and stage.llm:
+                stage.plan(todo)  # count only: no model run, no cache or translation memory writes
+            elif isinstance(stage, GroupedStage):
+                counts[stage.name] += stage.run(todo)
+            else:
+                counts[stage.name] += sum(1 for note in todo if stage.apply(note))
+            if metrics is not None:
+                metrics.record(stage.name, time.perf_counter() - stage_start, len(todo))
+
+        pending = [note for note, fields in zip(chunk, before) if note.fields != fields]
+        changed += len(pending)
+        if metrics is not None:
+            metrics.advance(len(note_ids[i:i + batch_size]))
+        if dry_run:
+            continue  # no note writes and no state recorded
+        write_start = time.perf_counter()
+        flush_notes(col, pending)
+        if metrics is not None and pending:
+            metrics.record("note_write", time.perf_counter() - write_start, len(pending))
+        if state is not None:
+            processed = [(note.id, mods.get(note.id), list(note.fields)) for note in chunk]
+            _record_state(col, state, stages, processed, [note.id for note in pending])
+
+    for stage in stages:
+        if not (dry_run and getattr(stage, "llm", False)):
+            print(stage.summary.format(name=stage.name, count=counts[stage.name]))
+        if isinstance(stage, GroupedStage):
+            stage.report()
+    if state is not None:
+        recomputed = len(note_ids) - skipped
+        print(f"Skipped {skipped} unchanged notes, recomputed {recomputed}.")
+        for stage in stages:
+            if unchanged[stage.name]:
+                print(f"  {stage.name}: {unchanged[stage.name]} notes with unchanged input.")
+    if dry_run:
+        print(f"Dry run: {changed} notes would be written.")
+    else:
+        print(f"Wrote {changed} changed notes.")
+    return counts
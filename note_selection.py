@@ -0,0 +1,110 @@
+import math
+import time
+
+
+def _escape(text, extra=""):
+    """Escape Anki search wildcards/quotes so text matches literally"""
+    for char in "\\\"*_" + extra:
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+class FieldEmpty:
+    """Select notes whose field at `index` is empty"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def search_term(self, field_names):
+        return f'"{_escape(field_names[self.index], ":")}:"'
+
+
+class FieldNotEmpty:
+    """Select notes whose field at `index` has any content"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def search_term(self, field_names):
+        return f'"{_escape(field_names[self.index], ":")}:_*"'
+
+
+class FieldEquals:
+    """Select notes whose field at `index` is exactly `value`"""
+
+    def __init__(self, index, value):
+        self.index = index
+        self.value = value
+
+    def search_term(self, field_names):
+        return f'"{_escape(field_names[self.index], ":")}:{_escape(self.value)}"'
+
+
+class ModifiedSince:
+    """Select notes edited at or after `timestamp` (epoch seconds)
+
+    Anki search can only narrow this to whole days (edited:N counts back from the
+    next day rollover, so one extra day covers the part before today's rollover);
+    the exact cut-off is applied afterwards with a read-only query on the notes table.
+    """
+
+    def __init__(self, timestamp):
+        self.timestamp = int(timestamp)
+
+    def search_term(self, field_names):
+        days = max(1, math.ceil((time.time() - self.timestamp) / 86400)) + 1
+        return f"edited:{days}"
+
+    def filter(self, col, note_ids, chunk_size=5000):
+        selected = []
+        for i in range(0, len(note_ids), chunk_size):
+            chunk = note_ids[i:i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            selected.extend(
+                col.db.list(
+                    f"select id from notes where mod >= ? and id in ({placeholders})",
+                    self.timestamp,
+                    *chunk,
+                )
+            )
+        return selected
+
+
+def deck_note_type(col, deck_name):
+    """Return the note type used by the deck and its subdecks (subs2srs decks hold a single one)"""
+    note_ids = col.find_notes(f'"deck:{deck_name}"')  # same deck match as select_notes
+    if not note_ids:  # empty deck
+        return None
+    return col.models.get(col.db.scalar("select mid from notes where id = ?", note_ids[0]))
+
+
+def select_notes(col, deck_name, criteria=()):
+    """Return IDs of notes in the deck matching all criteria, without loading any note
+
+    Field criteria become Anki search terms; ModifiedSince is refined in SQL.
+    """
+    note_type = deck_note_type(col, deck_name)
+    if note_type is None:  # empty deck
+        return []
+    field_names = [field["name"] for field in note_type["flds"]]
+    terms = [f'"deck:{deck_name}"', f"mid:{note_type['id']}"]
+    terms.extend(criterion.search_term(field_names) for criterion in criteria)
+    note_ids = list(col.find_notes(" ".join(terms)))
+    for criterion in criteria:
+        if hasattr(criterion, "filter"):
+            note_ids = criterion.filter(col, note_ids)
+    return note_ids
+
+
+def select_for_stages(col, deck_name, stages, since=None):
+    """Union of the candidates of every stage, in note ID order
+
+    A stage without a `select` list is a candidate for every note in the deck.
+    """
+    extra = [ModifiedSince(since)] if since is not None else []
+    note_ids = set()
+    for stage in stages:
+        note_ids.update(select_notes(col, deck_name, list(stage.select) + extra))
+        if not stage.select:  # already covers the whole deck
+            break
+    return sorted(note_ids)
@@ -0,0 +1,147 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_cache import cached_generate
+
+# "[3] answer" at the start of a line
+_NUMBER = re.compile(r"^\s*\[(\d+)\]\s*", re.MULTILINE)
+
+
+def pack_prompt(instructions, items):
+    """Build one prompt holding the shared instructions followed by numbered items"""
+    lines = [instructions.rstrip(), ""]
+    lines.extend(f"[{n}] {item}" for n, item in enumerate(items, start=1))
+    return "\n".join(lines)
+
+
+def parse_numbered(text, count):
+    """Split "[1] ... [2] ..." output into {number: answer}, ignoring unknown numbers"""
+    answers = {}
+    matches = list(_NUMBER.finditer(text))
+    for match, following in zip(matches, matches[1:] + [None]):
+        number = int(match.group(1))
+        end = following.start() if following else len(text)
+        if 1 <= number <= count and number not in answers:
+            answers[number] = text[match.end():end].strip()
+    return answers
+
+
+def first_line_parser(postprocess=None):
+    """parse_answer for generate_packed taking the first line of a numbered answer
+
+    `postprocess` is the clean-up the single-item path applies to its output, so
+    both paths fill the same field contents. An empty answer gives None, which
+    falls back to the single-item prompt.
+    """
+
+    def parse(item, answer):
+        answer = answer.split("\n")[0].strip()
+        if postprocess is not None:
+            answer = postprocess(answer)
+        return answer or None
+
+    return parse
+
+
+class ThroughputMeter:
+    """Count generated tokens and finished items to report tokens/sec and items/sec"""
+
+    def __init__(self):
+        self.tokens = 0
+        self.items = 0
+        self.prompts = 0
+        self.fallbacks = 0
+        self.started = time.perf_counter()
+
+    def callback(self, token_id, response):
+        """GPT4All per-token callback; returning True keeps generating"""
+        self.tokens += 1
+        return True
+
+    def log(self, *args):
+        """Per-item output; a plain meter always prints it"""
+        print(*args)
+
+    def record(self, name, seconds, items=1):
+        """Phase timing hook; a plain meter ignores it (see run_metrics.RunMetrics)"""
+
+    def count(self, name, n=1):
+        """Named counter hook; a plain meter ignores it"""
+
+    def report(self, label="LLM"):
+        seconds = max(time.perf_counter() - self.started, 1e-9)
+        print(
+            f"{label}: {self.items} items in {self.prompts} prompts "
+            f"({self.fallbacks} single-item fallbacks), {seconds:.1f}s, "
+            f"{self.tokens / seconds:.1f} tokens/sec, {self.items / seconds:.2f} items/sec"
+        )
+
+
+def generate_packed(
+    model,
+    items,
+    instructions,
+    render_item,  # render_item(item) -> text listed under the item's number
+    parse_answer,  # parse_answer(item, answer) -> result, or None to prompt single(item) instead
+    single,
+    pack_size=8,
+    cache=None,
+    model_name="",
+    meter=None,
+    max_tokens_per_item=60,
+    concurrency=1,  # packs in flight at once, for backends that serve requests in parallel
+    **params,
+):
+    """Run items through numbered K-item prompts and return one result per item, in order"""
+    callback = meter.callback if meter is not None else None
+
+    def run_batch(batch):
+        """Returns (results, prompts, fallbacks) for one pack"""
+        answers = {}
+        prompts = 0
+        fallbacks = 0
+        if len(batch) > 1:
+            prompt = pack_prompt(instructions, [render_item(item) for item in batch])
+            output = cached_generate(
+                model,
+                prompt,
+                cache=cache,
+                model_name=model_name,
+                callback=callback,
+                metrics=meter,
+                max_tokens=max_tokens_per_item * len(batch),
+                **params,
+            )
+            answers = parse_numbered(output, len(batch))
+            prompts += 1
+        results = []
+        for number, item in enumerate(batch, start=1):
+            result = None
+            if number in answers:
+                start = time.perf_counter()
+                result = parse_answer(item, answers[number])
+                if meter is not None:
+                    meter.record("validation", time.perf_counter() - start)
+            if result is None:
+                result = single(item)
+                prompts += 1
+                fallbacks += len(batch) > 1
+            results.append(result)
+        return results, prompts, fallbacks
+
+    batches = [items[i:i + pack_size] for i in range(0, len(items), pack_size)]
+    if concurrency > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(run_batch, batches))
+    else:
+        outcomes = map(run_batch, batches)
+
+    results = []
+    for batch_results, prompts, fallbacks in outcomes:
+        results.extend(batch_results)
+        if meter is not None:
+            meter.items += len(batch_results)
+            meter.prompts += prompts
+            meter.fallbacks += fallbacks
+    return results
@@ -0,0 +1,230 @@
+"""Phase timings, counters and progress for long runs, written as JSON or a Prometheus textfile"""
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from prompt_packing import ThroughputMeter
+
+SAMPLE_SIZE = 10_000  # latencies kept per phase for percentiles (reservoir sampled)
+
+
+class _Phase:
+    def __init__(self):
+        self.calls = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def record(self, seconds, items, rng):
+        self.calls += 1
+        self.items += items
+        self.seconds += seconds
+        per_item = seconds / items if items else seconds
+        self.max = max(self.max, per_item)
+        if len(self.samples) < SAMPLE_SIZE:
+            self.samples.append(per_item)
+        else:
+            slot = rng.randrange(self.calls)
+            if slot < SAMPLE_SIZE:
+                self.samples[slot] = per_item
+
+    def summary(self):
+        ordered = sorted(self.samples)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+
+        return {
+            "calls": self.calls,
+            "items": self.items,
+            "seconds": self.seconds,
+            "mean": self.seconds / self.items if self.items else 0.0,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": self.max,
+        }
+
+
+class RunMetrics(ThroughputMeter):
+    """Phase timings, counters and progress for one run (safe to share between threads)"""
+
+    def __init__(self, label="run", total=None, progress_every=30.0, verbose=True):
+        super().__init__()
+        self.label = label
+        self.total = total  # items expected, for the progress percentage and ETA
+        self.progress_every = progress_every  # seconds between progress lines, 0 = never
+        self.verbose = verbose  # print per-item details through log()
+        self.done = 0
+        self.phases = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._started_progress = self.started
+        self._last_progress = self.started
+
+    def callback(self, token_id, response):
+        with self._lock:
+            self.tokens += 1
+        return True
+
+    def log(self, *args):
+        if self.verbose:
+            print(*args)
+
+    def start(self, total=None, label=None):
+        """Begin a (new) unit of work, resetting progress but keeping totals"""
+        if label is not None:
+            self.label = label
+        self.total = total
+        self.done = 0
+        self._started_progress = time.perf_counter()
+        self._last_progress = self._started_progress
+
+    def record(self, name, seconds, items=1):
+        with self._lock:
+            self.phases.setdefault(name, _Phase()).record(seconds, items, self._rng)
+
+    @contextmanager
+    def phase(self, name, items=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, items)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def advance(self, n=1):
+        """Mark n items finished and print a progress line if one is due"""
+        self.done += n
+        now = time.perf_counter()
+        if self.progress_every and now - self._last_progress >= self.progress_every:
+            self._last_progress = now
+            print(self.progress_line(now))
+
+    def progress_line(self, now=None):
+        now = now or time.perf_counter()
+        elapsed = max(now - self._started_progress, 1e-9)
+        rate = self.done / elapsed
+        parts = [f"[{self.label}] {self.done}"]
+        if self.total:
+            parts[0] += f"/{self.total} ({100 * self.done / self.total:.1f}%)"
+        parts.append(f"{rate:.2f} items/s")
+        if self.total and rate > 0:
+            parts.append(f"ETA {_duration((self.total - self.done) / rate)}")
+        parts.append(f"{self.tokens / max(now - self.started, 1e-9):.1f} tok/s")
+        with self._lock:
+            busiest = sorted(self.phases.items(), key=lambda kv: -kv[1].seconds)[:3]
+            hits = self.counters.get("cache_hits", 0)
+        if busiest:
+            total_seconds = sum(phase.seconds for _, phase in busiest) or 1e-9
+            parts.append(" ".join(f"{name} {100 * phase.seconds / total_seconds:.0f}%" for name, phase in busiest))
+        if hits:
+            parts.append(f"{hits} cache hits")
+        return " | ".join(parts)
+
+    def snapshot(self):
+        """Everything recorded so far as a plain dict (also what write() saves as JSON)"""
+        with self._lock:
+            return {
+                "label": self.label,
+                "seconds": time.perf_counter() - self.started,
+                "items": self.items,
+                "done": self.done,
+                "tokens": self.tokens,
+                "prompts": self.prompts,
+                "fallbacks": self.fallbacks,
+                "counters": dict(self.counters),
+                "phases": {name: phase.summary() for name, phase in self.phases.items()},
+            }
+
+    def merge(self, snapshot):
+        """Add the totals of another RunMetrics' snapshot (e.g. from a worker process)"""
+        with self._lock:
+            self.tokens += snapshot["tokens"]
+            self.prompts += snapshot["prompts"]
+            self.fallbacks += snapshot["fallbacks"]
+            self.items += snapshot["items"]
+            for name, n in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, summary in snapshot["phases"].items():
+                phase = self.phases.setdefault(name, _Phase())
+                phase.calls += summary["calls"]
+                phase.items += summary["items"]
+                phase.seconds += summary["seconds"]
+                phase.max = max(phase.max, summary["max"])
+                phase.samples.extend([summary["p50"], summary["p95"]])  # percentiles become approximate
+
+    def report(self, label=None):
+        super().report(label or self.label)
+        summary = self.snapshot()
+        for name, phase in sorted(summary["phases"].items(), key=lambda kv: -kv[1]["seconds"]):
+            print(
+                f"  {name:<34} {phase['seconds']:9.2f}s  {phase['items']:>7} items  "
+                f"mean {1000 * phase['mean']:.2f}ms  p95 {1000 * phase['p95']:.2f}ms"
+            )
+        if summary["counters"]:
+            print("  " + ", ".join(f"{name} {n}" for name, n in sorted(summary["counters"].items())))
+
+    def write(self, path):
+        """Save the snapshot as JSON, or as a Prometheus textfile if path ends in .prom"""
+        summary = self.snapshot()
+        if path.endswith(".prom"):
+            text = _prometheus(summary)
+        else:
+            text = json.dumps(summary, indent=2) + "\n"
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)  # textfile collectors must never see a half-written file
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def _prometheus(summary):
+    run = summary["label"].replace("\\", "\\\\").replace('"', '\\"')
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP anki_utils_{name} {help_text}")
+        lines.append(f"# TYPE anki_utils_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join([f'run="{run}"'] + [f'{k}="{v}"' for k, v in labels.items()])
+            lines.append(f"anki_utils_{name}{{{label_text}}} {value}")
+
+    metric("run_seconds", "gauge", "Wall time of the run", [({}, summary["seconds"])])
+    metric("items_total", "counter", "Items finished", [({}, summary["items"])])
+    metric("tokens_total", "counter", "Tokens generated", [({}, summary["tokens"])])
+    metric("prompts_total", "counter", "Prompts sent to the model", [({}, summary["prompts"])])
+    metric(
+        "events_total",
+        "counter",
+        "Named counters (cache hits, retries, ...)",
+        [({"name": name}, n) for name, n in sorted(summary["counters"].items())],
+    )
+    phases = sorted(summary["phases"].items())
+    metric("phase_seconds_total", "counter", "Time spent per phase", [({"phase": n}, p["seconds"]) for n, p in phases])
+    metric("phase_items_total", "counter", "Items timed per phase", [({"phase": n}, p["items"]) for n, p in phases])
+    metric(
+        "phase_item_seconds",
+        "gauge",
+        "Per-item latency per phase",
+        [
+            ({"phase": n, "quantile": q}, p[key])
+            for n, p in phases
+            for q, key in (("0.5", "p50"), ("0.95", "p95"), ("1", "max"))
+        ],
+    )
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,118 @@
+import os
+import socket
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import stub_llm  # noqa: E402
+from llm_backend import BackendError, OpenAIServerBackend  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**kwargs):
+        server, url = stub_llm.serve(**kwargs)
+        servers.append(server)
+        return server.RequestHandlerClass, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def backend():
+    backends = []
+
+    def make(url, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        backend = OpenAIServerBackend(url, **kwargs)
+        backends.append(backend)
+        return backend
+
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+def test_concurrent_requests_reuse_keep_alive_connections(server, backend):
+    handler, url = server(latency=0.01)
+    client = backend(url, concurrency=4)
+    prompts = [f"prompt {i}" for i in range(40)]
+
+    outputs = client.generate_many(prompts)
+
+    assert outputs == [stub_llm.stub_reply(prompt) for prompt in prompts]
+    assert handler.requests == 40
+    assert len(handler.connections) <= 4
+
+
+def test_retries_with_backoff_on_server_errors(server, backend):
+    handler, url = server(fail_every=2)
+    client = backend(url, concurrency=1, retries=3)
+
+    outputs = [client.generate(f"prompt {i}") for i in range(5)]
+
+    assert outputs == [stub_llm.stub_reply(f"prompt {i}") for i in range(5)]
+    assert handler.requests > 5  # every second request was a 503 and retried
+
+
+def test_streaming_stops_when_callback_returns_false(server, backend):
+    _, url = server()
+    client = backend(url, concurrency=1)
+    prompt = "[1] one\n[2] two\n[3] three"
+    tokens = []
+
+    def first_token_only(token_id, token):
+        tokens.append(token)
+        return False
+
+    output = client.generate(prompt, callback=first_token_only)
+
+    assert tokens == [output]
+    assert output == "[1] "
+    # the dropped connection is not reused, so the next request still works
+    assert client.generate(prompt) == stub_llm.stub_reply(prompt)
+
+
+def test_client_error_raises_backend_error_without_retrying(server, backend):
+    handler, url = server()
+    client = backend(url + "/missing", retries=3)
+
+    with pytest.raises(BackendError, match="HTTP 404"):
+        client.generate("prompt")
+    assert handler.requests == 1
+
+
+def test_refused_connection_raises_backend_error():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # closed again, so nothing listens here
+    client = OpenAIServerBackend(f"http://127.0.0.1:{port}", retries=1, backoff=0.01)
+    try:
+        with pytest.raises(BackendError, match="giving up after 2 attempts"):
+            client.generate("prompt")
+    finally:
+        client.close()
+
+
+def test_stream_failing_after_tokens_is_not_retried(server, backend):
+    handler, url = server(drop_stream_after=1)
+    client = backend(url, concurrency=1, retries=3)
+    tokens = []
+
+    def collect(token_id, token):
+        tokens.append(token)
+        return True
+
+    with pytest.raises(BackendError, match="after tokens were delivered"):
+        client.generate("[1] one\n[2] two", callback=collect)
+    assert tokens == ["[1] "]  # not replayed by a retry
+    assert handler.requests == 1
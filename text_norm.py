@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+
+PINYIN_CACHE_SIZE = 200_000  # distinct segments kept in the pinyin LRU cache
+
+# Runs of Han characters (pypinyin's phrase matching never crosses a non-Han character)
+_HAN = "\u3007\u2e80-\u2fff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002ffff"
+_SEGMENT = re.compile(f"[{_HAN}]+|[^{_HAN}]+")
+
+# CJK blocks scanned when building the traditional-only character set
+_CJK_RANGES = [
+    (0x3400, 0x4DBF),
+    (0x4E00, 0x9FFF),
+    (0xF900, 0xFAFF),
+    (0x20000, 0x2FFFF),
+]
+
+_converter = None
+_trad_only = None
+
+
+@lru_cache(maxsize=PINYIN_CACHE_SIZE)
+def _segment_pinyin(segment, style):
+    from pypinyin import pinyin
+
+    py = pinyin(segment) if style is None else pinyin(segment, style=style)
+    return tuple(item for sublist in py for item in sublist)
+
+
+def to_pinyin(sentence, style=None):
+    """Pinyin for a sentence, items joined by spaces (same output as pypinyin.pinyin)
+
+    Each run of Han / non-Han characters is looked up in a bounded LRU cache, so
+    repeated words and lines are only converted once.
+    """
+    items = []
+    for segment in _SEGMENT.findall(sentence):
+        items.extend(_segment_pinyin(segment, style))
+    return " ".join(items)
+
+
+def to_pinyin_batch(sentences, style=None):
+    """Pinyin for a whole list of sentences in one call"""
+    return [to_pinyin(sentence, style) for sentence in sentences]
+
+
+def get_converter():
+    global _converter
+    if _converter is None:
+        import opencc
+
+        _converter = opencc.OpenCC("t2s")  # traditional to simplified converter
+    return _converter
+
+
+def _config_dicts(node):
+    """Dictionary file names used by an OpenCC config (groups are flattened)"""
+    if isinstance(node, dict):
+        if node.get("type") == "group":
+            return [name for child in node["dicts"] for name in _config_dicts(child)]
+        if "file" in node:
+            return [node["file"]]
+        return [name for value in node.values() for name in _config_dicts(value)]
+    if isinstance(node, list):
+        return [name for child in node for name in _config_dicts(child)]
+    return []
+
+
+def _dictionary_lines(config="t2s.json"):
+    """Every "key\tvalue value ..." line of the dictionaries behind an OpenCC config
+
+    Text dictionaries are read directly; compiled .ocd2 ones are dumped with OpenCC's
+    own opencc_dict tool. Returns None when a dictionary cannot be read.
+    """
+    import opencc
+
+    package_dir = os.path.dirname(opencc.__file__)
+    share_dirs = [
+        getattr(opencc, "_opencc_share_dir", ""),
+        os.path.join(package_dir, "config"),
+        os.path.join(package_dir, "dictionary"),
+        "/usr/share/opencc",
+        "/usr/local/share/opencc",
+        "/opt/homebrew/share/opencc",
+    ]
+    config_path = next(
+        (os.path.join(d, config) for d in share_dirs if os.path.isfile(os.path.join(d, config))),
+        None,
+    )
+    if config_path is None:
+        return None
+    with open(config_path, encoding="utf-8") as f:
+        names = _config_dicts(json.load(f))
+    search = [os.path.dirname(config_path)] + share_dirs
+    tool = shutil.which("opencc_dict") or os.path.join(package_dir, "clib", "bin", "opencc_dict")
+    lines = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            path = next((os.path.join(d, name) for d in search if os.path.isfile(os.path.join(d, name))), None)
+            if path is None:
+                return None
+            if path.endswith(".ocd2"):
+                text_path = os.path.join(tmp, name + ".txt")
+                try:
+                    subprocess.run(
+                        [tool, "-i", path, "-o", text_path, "-f", "ocd2", "-t", "text"],
+                        check=True,
+                        capture_output=True,
+                    )
+                except (OSError, subprocess.CalledProcessError):
+                    return None
+                path = text_path
+            with open(path, encoding="utf-8") as f:
+                lines.extend(line.rstrip("\n") for line in f if "\t" in line)
+    return lines
+
+
+def trad_only_chars():
+    """Code points that can make OpenCC t2s change a sentence, computed once
+
+    That is every character t2s changes on its own, every character of a phrase
+    dictionary key and every character with more than one candidate. Sentences with
+    none of these are returned as-is without calling OpenCC. If the dictionaries
+    cannot be read, the set is None and every sentence goes through OpenCC.
+    """
+    global _trad_only
+    if _trad_only is None:
+        chars = [chr(cp) for start, end in _CJK_RANGES for cp in range(start, end + 1)]
+        converted = get_converter().convert("\n".join(chars)).split("\n")
+        if len(converted) != len(chars):  # a conversion changed the line structure
+            converted = [get_converter().convert(char) for char in chars]
+        trad_only = {char for char, simplified in zip(chars, converted) if char != simplified}
+        lines = _dictionary_lines()
+        if lines is None:
+            _trad_only = False
+            return None
+        for line in lines:
+            key, _, values = line.partition("\t")
+            if len(key) > 1 or len(values.split()) > 1 or values != key:
+                trad_only.update(key)
+        _trad_only = frozenset(trad_only)
+    return _trad_only or None
+
+
+def needs_conversion(sentence):
+    """True if OpenCC may change the sentence"""
+    trad_only = trad_only_chars()
+    return trad_only is None or not trad_only.isdisjoint(sentence)
+
+
+def to_simplified(sentence):
+    """Convert traditional characters to simplified, skipping OpenCC when there are none"""
+    if not needs_conversion(sentence):
+        return sentence
+    return get_converter().convert(sentence)
+
+
+def to_simplified_batch(sentences):
+    """Convert a whole list of sentences, with one OpenCC call for those that need it"""
+    results = list(sentences)
+    todo = [
+        i for i, sentence in enumerate(results)
+        if "\n" not in sentence and needs_conversion(sentence)
+    ]
+    if todo:
+        converted = get_converter().convert("\n".join(results[i] for i in todo)).split("\n")
+        if len(converted) == len(todo):
+            for i, simplified in zip(todo, converted):
+                results[i] = simplified
+        else:  # line structure changed, convert one by one
+            for i in todo:
+                results[i] = get_converter().convert(results[i])
+    for i, sentence in enumerate(results):
+        if "\n" in sentence:
+            results[i] = to_simplified(sentence)
+    return results
@@ -0,0 +1,190 @@
+"""Persistent translation memory with MinHash LSH near-duplicate lookup"""
+
+import hashlib
+import re
+import sqlite3
+import struct
+from collections import namedtuple
+
+DEFAULT_TM_PATH = "translation_memory.sqlite"
+
+BANDS = 16
+ROWS = 2  # MinHash values per band; P(candidate) = 1 - (1 - s^ROWS)^BANDS
+_PRIME = (1 << 61) - 1
+# fixed (a, b) pairs for the hash permutations, so signatures are stable across runs
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.sha1(b"a%d" % i).digest()[:8], "little") % (_PRIME - 1) + 1,
+        int.from_bytes(hashlib.sha1(b"b%d" % i).digest()[:8], "little") % _PRIME,
+    )
+    for i in range(BANDS * ROWS)
+]
+_IGNORED = re.compile(r"[\W_]+")  # punctuation, symbols and whitespace (CJK included)
+
+# exact: equal to the looked up line once punctuation and spacing are removed
+Match = namedtuple("Match", ["source", "target", "similarity", "exact"])
+
+
+def normalize(sentence):
+    """Drop punctuation, symbols and spacing, and lowercase any latin text"""
+    return _IGNORED.sub("", sentence).lower()
+
+
+def shingles(text):
+    """Character bigrams (a single character is its own shingle)"""
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _shingle_hash(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def signature(grams):
+    """MinHash signature: the minimum of each hash permutation over the shingles"""
+    hashes = [_shingle_hash(gram) for gram in grams]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def buckets(grams):
+    """One signed 64-bit LSH bucket id per band"""
+    sig = signature(grams)
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                struct.pack(f"<I{ROWS}Q", band, *sig[band * ROWS:(band + 1) * ROWS]), digest_size=8
+            ).digest(),
+            "little",
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+class TranslationMemory:
+    """On-disk store of source -> translation pairs, searchable by similarity
+
+    `similarity` is the minimum Jaccard similarity of character bigrams for a
+    stored sentence to be returned; candidates from the LSH buckets are verified
+    exactly, and only the `max_candidates` sharing the most bands are checked.
+    """
+
+    def __init__(self, path=DEFAULT_TM_PATH, similarity=0.7, max_candidates=64):
+        self.path = path
+        self.similarity = similarity
+        self.max_candidates = max_candidates
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                norm TEXT NOT NULL UNIQUE,
+                source TEXT NOT NULL,
+                target TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                bucket INTEGER NOT NULL,
+                entry INTEGER NOT NULL,
+                PRIMARY KEY (bucket, entry)
+            ) WITHOUT ROWID
+            """
+        )
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def add(self, source, target):
+        """Store a translation; a later translation of the same normalized line replaces it"""
+        norm = normalize(source)
+        if not norm or not target:
+            return
+        row = self.conn.execute("SELECT id FROM entries WHERE norm = ?", (norm,)).fetchone()
+        if row is not None:
+            self.conn.execute(
+                "UPDATE entries SET source = ?, target = ? WHERE id = ?", (source, target, row[0])
+            )
+            return
+        entry = self.conn.execute(
+            "INSERT INTO entries (norm, source, target) VALUES (?, ?, ?)", (norm, source, target)
+        ).lastrowid
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO buckets (bucket, entry) VALUES (?, ?)",
+            [(bucket, entry) for bucket in buckets(shingles(norm))],
+        )
+
+    def add_many(self, pairs):
+        for source, target in pairs:
+            self.add(source, target)
+        self.conn.commit()
+
+    def exact(self, source):
+        """The stored translation of this line (ignoring punctuation/spacing), or None"""
+        row = self.conn.execute(
+            "SELECT target FROM entries WHERE norm = ?", (normalize(source),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, source, limit=3):
+        """Up to `limit` stored matches at or above the similarity threshold, best first"""
+        norm = normalize(source)
+        if not norm:
+            return []
+        row = self.conn.execute(
+            "SELECT source, target FROM entries WHERE norm = ?", (norm,)
+        ).fetchone()
+        if row is not None:
+            self.exact_hits += 1
+            return [Match(row[0], row[1], 1.0, True)]
+        grams = shingles(norm)
+        ids = buckets(grams)
+        # entries sharing the most bands are the likeliest matches, so they are verified first
+        rows = self.conn.execute(
+            f"""
+            SELECT e.norm, e.source, e.target FROM entries e
+            JOIN (
+                SELECT entry, COUNT(*) AS shared FROM buckets
+                WHERE bucket IN ({",".join("?" * len(ids))})
+                GROUP BY entry ORDER BY shared DESC LIMIT ?
+            ) c ON c.entry = e.id
+            """,
+            (*ids, self.max_candidates),
+        ).fetchall()
+        matches = []
+        for candidate, stored_source, target in rows:
+            score = jaccard(grams, shingles(candidate))
+            if score >= self.similarity:
+                matches.append(Match(stored_source, target, score, False))
+        matches.sort(key=lambda match: -match.similarity)
+        if matches:
+            self.near_hits += 1
+        else:
+            self.misses += 1
+        return matches[:limit]
+
+    def stats(self):
+        return (
+            f"Translation memory: {self.exact_hits} exact reuses, "
+            f"{self.near_hits} near matches, {self.misses} misses"
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()